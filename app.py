@@ -1,10 +1,21 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import pathlib
+from streamlit.scriptrunner import get_script_run_ctx
+from utils.app_cache import DiskCache
+from utils.app_classes import DataHandler
 from utils.app_funcs import *
-from io import BytesIO
+from utils.app_partitions import DatePartitions
+from utils.app_profile import (
+    end_rerun,
+    get_object_summary,
+    get_session_report,
+    get_stage_report,
+    profile_stage,
+    reruns,
+    start_profiling,
+    take_snapshot,
+)
 
 # set cwd
 cwd = pathlib.Path.cwd()
@@ -13,23 +24,168 @@ st.set_page_config(
     page_title='Covid-19 Dashboard Spain',
     layout = 'wide',
 )
-# split into sections
+# opt-in memory profiling, adds the diagnostics section
+profiling = start_profiling()
+sections = SECTIONS + ['Diagnostics'] if profiling else SECTIONS
+# split into sections, ?section=<name> links to a section
+query_section = st.experimental_get_query_params().get('section', [SECTIONS[0]])[0]
 rad = st.sidebar.radio(
     label = "Navigation",
-    options = [
-        "Overview",
-        "Cases",
-        "Hospitalizations",
-        "ICU Admissions",
-        "Deaths",
-    ]
+    options = sections,
+    index = sections.index(query_section) if query_section in sections else 0,
 )
-# read csv to process
-data = pd.read_csv(cwd / 'data/covid_19_spain.csv', sep = ';')
-prov = pd.read_csv(cwd / 'data/provincias.csv')
-pop = pd.read_csv(cwd / 'data/population_spain_10s.csv')
-# map province to autonomous community
-data = map_province(data, prov)
+# monthly partitions of the covid data, assets pre-rendered by
+# `python -m utils.app_classes` for this data version
+partitions = DatePartitions(cwd / 'data/partitions')
+data_version = get_data_version(partitions.partitions_dir)
+assets_dir = cwd / 'assets' / data_version
+# figures and aggregates computed on the fly, shared by every worker process
+cache = DiskCache()
+
+
+@st.experimental_singleton
+def load_population():
+    # population table, its province x age pivot and the province dimension, once per process
+    pop = pd.read_csv(cwd / 'data/population_spain_10s.csv')
+    prov = pd.read_csv(cwd / 'data/provincias.csv', keep_default_na=False)
+    # per-province population from the 5-year bands, the 10-year table has no Navarra row
+    pop_5s = pd.read_csv(cwd / 'data/population_spain_5s.csv')
+    province_pop_dim = rebin_population(get_population_dim(pop_5s))
+    return pop, get_population_dim(pop), get_province_dim(prov, pop), province_pop_dim
+
+
+@st.experimental_singleton
+def load_month(data_version, month):
+    # one monthly partition, shared by every session so treat it as read-only
+    entry = partitions.manifest['partitions'][month]
+    data = read_covid_data(partitions, entry['first_date'], entry['last_date'])
+    prov = pd.read_csv(cwd / 'data/provincias.csv', keep_default_na=False)
+    # map province to autonomous community, once per partition
+    return map_province(data, prov)
+
+
+def load_data(start_date=None, end_date=None):
+    # date-sorted rows of a date range, only the months it touches are read
+    data = pd.concat(
+        [load_month(data_version, month) for month in partitions.get_months(start_date, end_date)],
+        ignore_index=True,
+        )
+    if start_date is None:
+        return data
+    return get_date_slice(data, start_date, end_date)
+
+
+@st.experimental_singleton
+def load_store(data_version):
+    # memory-mapped counts written by the build, None if it has not run
+    store_dir = cwd / 'assets' / data_version / 'store'
+    return DenseStore(store_dir) if (store_dir / 'axes.json').exists() else None
+
+
+@st.experimental_singleton
+def load_forecasts(data_version):
+    # forecasts fit by the build, fit on the fly and shared by the workers if missing
+    path = cwd / 'assets' / data_version / 'forecasts.csv'
+    if path.exists():
+        return pd.read_csv(path, sep=';', parse_dates=['date'])
+    data = load_store(data_version) or load_data()
+    return cache.memoize(('forecasts', data_version), get_forecasts, data)
+
+
+@st.experimental_memo(max_entries=256)
+def segment_waves(data_version, width, prominence, window):
+    # waves of every date of the store, segmented on the small daily totals
+    store = load_store(data_version)
+    daily_cases = store.sum(('date', 'variable'))[:, store.axes['variable'].get_loc('cases')]
+    return get_wave_labels(daily_cases, width, prominence, window)
+
+
+def get_store():
+    # store with the waves of the sidebar parameters, None if the build has not run
+    store = load_store(data_version)
+    if store is None or default_waves:
+        return store
+    return store.with_waves(segment_waves(data_version, *wave_params))
+
+
+def get_data_range(start_date, end_date):
+    # date range of the store as a zero-copy view, of the partitions it touches otherwise
+    store = get_store()
+    if store is not None:
+        return store.slice_dates(start_date, end_date)
+    return load_data(start_date, end_date)
+
+
+@st.experimental_singleton
+def load_published_assets(section_dir):
+    # figures parsed once per process, the directory is under the data version
+    return load_section_assets(section_dir)
+
+
+def get_section_assets(variable):
+    # serve pre-rendered assets for the whole history and the published waves,
+    # render other ranges and waves on the fly
+    with profile_stage('section: {}'.format(variable)):
+        section_dir = assets_dir / variable
+        published = full_range and default_waves and has_section_assets(section_dir)
+        figures = load_published_assets(section_dir) if published else None
+        if figures is None:
+            key = ('section', data_version, variable)
+            if not published:
+                key += (start_date, end_date) + (() if default_waves else wave_params)
+            figures = cache.memoize(key, compute_figures, variable, start_date, end_date)
+    return figures
+
+
+@st.experimental_singleton
+def get_loaded_version():
+    # data version the singletons below hold, shared by every session of the process
+    return {'version': None}
+
+
+def clear_stale_versions(data_version):
+    # a new build or update leaves the previous version unused, drop it from memory
+    loaded = get_loaded_version()
+    if loaded['version'] not in (None, data_version):
+        for loader in (load_month, load_store, load_forecasts, segment_waves, load_published_assets):
+            loader.clear()
+    loaded['version'] = data_version
+
+
+def compute_figures(variable, start_date, end_date):
+    # the sma7 needs the days before the range, it is sliced from the whole history
+    age_series = get_sma7_gby_age_date(load_store(data_version) or load_data())
+    age_series = age_series[age_series.date.between(pd.Timestamp(start_date), pd.Timestamp(end_date))]
+    figures, _ = compute_section_assets(get_data_range(start_date, end_date), pop_dim, variable, age_series)
+    return figures
+
+
+clear_stale_versions(data_version)
+pop, pop_dim, prov_dim, province_pop_dim = load_population()
+# global date range, applied to every section
+store = load_store(data_version)
+months = list(partitions.manifest['partitions'].values())
+first_date, last_date = (pd.Timestamp(date).date() for date in (months[0]['first_date'], months[-1]['last_date']))
+date_range = st.sidebar.date_input(
+    'Date range',
+    value=(first_date, last_date),
+    min_value=first_date,
+    max_value=last_date,
+    )
+# the range picker returns a single date while the user is choosing
+start_date, end_date = date_range if len(date_range) == 2 else (date_range[0],) * 2
+full_range = (start_date, end_date) == (first_date, last_date)
+# wave detection parameters, the defaults give the published waves
+with st.sidebar.expander('Wave detection'):
+    if store is None:
+        st.info("Tuning the waves needs the dense store, build it with `python -m utils.app_classes`.")
+    width = st.slider('Minimum peak width (days)', 5, 60, WAVE_WIDTH, disabled=store is None)
+    prominence = st.slider('Minimum peak prominence (share of the highest peak)', 0.0, 0.5,
+        WAVE_PROMINENCE, 0.01, disabled=store is None)
+    window = st.slider('Smoothing window (days)', 1, 28, WAVE_WINDOW, disabled=store is None)
+wave_params = (width, prominence, window)
+default_waves = wave_params == (WAVE_WIDTH, WAVE_PROMINENCE, WAVE_WINDOW)
+
 
 ##################
 # OVERVIEW SECTION
@@ -50,18 +206,42 @@ if rad== "Overview":
     """)
 
     if st.button('Update Data'):
-        new_data = get_data()
-        new_data = get_waves(get_sma7,new_data)
-        new_data.to_csv(cwd / 'data/covid_19_spain.csv', sep = ';', index=False)
-
-    data = pd.read_csv(cwd / 'data/covid_19_spain.csv', sep = ';')
-    prov = pd.read_csv(cwd / 'data/provincias.csv')
-    data = map_province(data, prov)
-    st.write("Last Update: {}".format(data.date.max()))
+        handler = DataHandler(DATA_SOURCE, cwd / 'data')
+        try:
+            handler.update_covid_data()
+        except ValueError as e:
+            # a bad feed leaves the current data and its caches untouched
+            st.error(str(e))
+        else:
+            # same path as the build: only the revised months and the waves are rewritten
+            handler.compute_wave_variable()
+            # start over on the new version, which drops the previous one from memory
+            st.experimental_rerun()
+
+    st.write("Last Update: {}".format(last_date))
     st.markdown("""
     ### Covid Data
     """)
-    st.dataframe(data.sort_values('date', ascending=False))
+    # filters, only the partitions of the sidebar date range are read
+    data = load_data(start_date, end_date)
+    col1, col2, col3 = st.columns(3)
+    provinces = col1.multiselect('Province', sorted(data.province.dropna().unique()))
+    ages = col2.multiselect('Age', sorted(data.age.unique()))
+    sexes = col3.multiselect('Sex', sorted(data.sex.unique()))
+    filtered = filter_covid_data(data, start_date, end_date, provinces, ages, sexes)
+    # paginated table, newest rows first
+    col1, col2, col3 = st.columns([1, 1, 2])
+    page_size = col1.selectbox('Rows per page', [50, 100, 500, 1000], index=1)
+    n_pages = max(-(-len(filtered) // page_size), 1)
+    page = col2.number_input('Page', min_value=1, max_value=n_pages, value=1)
+    col3.write('{:,} rows, {:,} pages'.format(len(filtered), n_pages))
+    st.dataframe(get_page(filtered, int(page) - 1, page_size))
+    # export of the filtered rows
+    col1, col2 = st.columns(2)
+    if col1.button('Prepare CSV export'):
+        col1.download_button('Download CSV', export_csv(filtered), 'covid_19_spain.csv', 'text/csv')
+    if col2.button('Prepare Parquet export'):
+        col2.download_button('Download Parquet', export_parquet(filtered), 'covid_19_spain.parquet')
 
     # wave barplot
 
@@ -75,65 +255,38 @@ if rad== "Overview":
 ################
 
 if rad == "Cases":
+    figures = get_section_assets('cases')
 
     # 1. Lineplot Figure
     st.write("""
     ## Daily Cases By Age
     """)
-    # process the data to plot
-    age_series = get_sma7_gby_age_date(data)
-    fig = plot_lineplot(age_series, 'dailyCases')
-    # send to streamlit
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(figures['lineplot'], use_container_width=True)
     
-    # 2. Wave Totals Figure
+    # 2. Wave Totals Figure: wave/age heatmap + wave totals barplot
     st.write("""
     ## Within-Wave Distribution by Age and Total Cases
     """)
-    # get data for wave heatmap
-    heatmap = get_wave_heatmap_data(data, variable='cases')
-    # get data for barplot
-    wave_totals = data.groupby('wave', as_index=False).sum()
-    # plot wave figure: wave/age heatmap + wave totals barplot
-    fig = plot_wave_heatmap(
-        heatmap_data=heatmap, 
-        barplot_data=wave_totals, 
-        variable='cases')
-    # save to image and plot
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    st.image(buf)
-
-    # 3. Age totals Figure
+    st.image(figures['wave_heatmap'])
+
+    # 3. Age totals Figure: age/wave heatmap + age totals barplot
     st.write("""
     ## Within-Age Distribution by Wave and Total Cases
     """)
-    # get data for heatmap
-    heatmap = get_age_heatmap_data(data, variable='cases')
-    # get data for barplot
-    age_totals = data.groupby('age').sum().drop('NC').reset_index()
-    # plot population figure: age/wave heatmap + age totals barplot
-    fig = plot_heatmap_age(
-        heatmap_data=heatmap, 
-        barplot_data=age_totals, 
-        variable='cases')
-    # save to image and plot
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    st.image(buf)
+    st.image(figures['age_heatmap'])
 
     # 4. Heatmap of cases and total pop
     st.write("""
     ## Total Cases as % of Total Age Group Population and Total Age Group Population
     """)
-    # get heatmap data
-    heatmap = get_age_totalpop_norm_heatmap_data(data, pop, 'cases')
-    # get barplot data
-    pop_totals = pop.groupby('age').population.sum().drop('total').reset_index()
-    fig = plot_heatmap_pop(heatmap, pop_totals)
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    st.image(buf)
+    st.image(figures['ratio_heatmap'])
+
+    # calendar heatmap by age group and week or month
+    st.write("""
+    ## Cases per 100k by Age Group and Week or Month
+    """)
+    bucket = st.selectbox('Time bucket', list(TIME_BUCKETS))
+    st.plotly_chart(figures['{}_heatmap'.format(bucket)], use_container_width=True)
 
 
 ##########################
@@ -141,188 +294,189 @@ if rad == "Cases":
 ##########################
 
 if rad == "Hospitalizations":
+    figures = get_section_assets('hospitalizations')
 
     st.write("""
     ## Daily Hospitalizations By Age
     """)
-    # process the data to plot
-    age_series = get_sma7_gby_age_date(data)
-    fig = plot_lineplot(age_series, 'dailyHospitalizations')
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(figures['lineplot'], use_container_width=True)
 
     st.write("""
     ## Within-Wave Distribution by Age and Total Hospitalizations
     """)
-
-    # get data for heatmap and wave totals
-    heatmap = get_wave_heatmap_data(data, variable='hospitalizations')
-    wave_totals = data.groupby('wave', as_index=False).sum()
-
-    # plot heatmap + barplot
-    fig = plot_wave_heatmap(
-        heatmap_data=heatmap, 
-        barplot_data=wave_totals, 
-        variable='hospitalizations')
-
-    # save to image and 
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    st.image(buf)
+    st.image(figures['wave_heatmap'])
 
     # heatmap + totals by age section
     st.write("""
     ## Within-Age Distribution by Wave and Total Hospitalizations
     """)
-
-    # get data for heatmap and total pop
-    heatmap = get_age_heatmap_data(data, variable='hospitalizations')
-    age_totals = data.groupby('age').sum().drop('NC').reset_index()
-
-    # plot population heatmap + barplot
-    fig = plot_heatmap_age(
-        heatmap_data=heatmap, 
-        barplot_data=age_totals, 
-        variable='hospitalizations')
-
-    # save to image and 
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    st.image(buf)
+    st.image(figures['age_heatmap'])
 
     # 2. Heatmap of hosp as % of cases and Hosp as % of pop
     st.write("""
     ## Total Hospitalizations as % of Total Cases & as % of total Age-Group Population
     """)
-    hosp_cases, hosp_total_pop = get_hosp_ratio_data(data, pop)
-    fig = plot_heatmap_ratios_hosp(hosp_cases, hosp_total_pop)
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    st.image(buf)
+    st.image(figures['ratio_heatmap'])
+
+    # calendar heatmap by age group and week or month
+    st.write("""
+    ## Hospitalizations per 100k by Age Group and Week or Month
+    """)
+    bucket = st.selectbox('Time bucket', list(TIME_BUCKETS))
+    st.plotly_chart(figures['{}_heatmap'.format(bucket)], use_container_width=True)
 
 ########################
 # ICU ADMISSIONS SECTION
 ########################
 
 if rad == "ICU Admissions":
+    figures = get_section_assets('icu')
 
     st.write("""
     ## Daily ICU By Age
     """)
-    # process the data to plot
-    age_series = get_sma7_gby_age_date(data)
-    fig = plot_lineplot(age_series, 'dailyICU')
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(figures['lineplot'], use_container_width=True)
 
     st.write("""
     ## Within-Wave Distribution by Age and Total ICU
     """)
-
-    # get data for heatmap and wave totals
-    heatmap = get_wave_heatmap_data(data, variable='icu')
-    wave_totals = data.groupby('wave', as_index=False).sum()
-
-    # plot heatmap + barplot
-    fig = plot_wave_heatmap(
-        heatmap_data=heatmap, 
-        barplot_data=wave_totals, 
-        variable='icu')
-
-    # save to image and 
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    st.image(buf)
+    st.image(figures['wave_heatmap'])
 
     # heatmap + totals by age section
     st.write("""
     ## Within-Age Distribution by Wave and Total ICU Admissions
     """)
-
-    # get data for heatmap and total pop
-    heatmap = get_age_heatmap_data(data, variable='icu')
-    age_totals = data.groupby('age').sum().drop('NC').reset_index()
-
-    # plot population heatmap + barplot
-    fig = plot_heatmap_age(
-        heatmap_data=heatmap, 
-        barplot_data=age_totals, 
-        variable='icu')
-
-    # save to image and 
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    st.image(buf)
+    st.image(figures['age_heatmap'])
 
     # 3. Heatmap of ICU as % of Hosp and ICU as % of pop
     st.write("""
     ## Total ICU Admissions as % of Total Hospitalizations & as % of total Age-Group Population
     """)
-    icu_hosp, icu_total_pop = get_icu_ratio_data(data, pop)
-    fig = plot_heatmap_ratios_icu(icu_hosp, icu_total_pop)
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    st.image(buf)
+    st.image(figures['ratio_heatmap'])
+
+    # calendar heatmap by age group and week or month
+    st.write("""
+    ## ICU Admissions per 100k by Age Group and Week or Month
+    """)
+    bucket = st.selectbox('Time bucket', list(TIME_BUCKETS))
+    st.plotly_chart(figures['{}_heatmap'.format(bucket)], use_container_width=True)
 
 ################
 # DEATHS SECTION
 ################
 
 if rad == "Deaths":
+    figures = get_section_assets('deaths')
 
     st.write("""
     ## Daily Deaths By Age
     """)
-    # process the data to plot
-    age_series = get_sma7_gby_age_date(data)
-    fig = plot_lineplot(age_series, 'dailyDeaths')
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(figures['lineplot'], use_container_width=True)
 
     st.write("""
     ## Within-Wave Distribution by Age and Total Deaths
     """)
-
-    # get data for heatmap and wave totals
-    heatmap = get_wave_heatmap_data(data, variable='deaths')
-    wave_totals = data.groupby('wave', as_index=False).sum()
-
-    # plot wave heatmap + wave totals barplot
-    fig = plot_wave_heatmap(
-        heatmap_data=heatmap, 
-        barplot_data=wave_totals, 
-        variable='deaths')
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    st.image(buf)
+    st.image(figures['wave_heatmap'])
 
     # heatmap + totals by age section
     st.write("""
     ## Within-Age Distribution by Wave and Total Deaths
     """)
-
-    # get data for heatmap and total pop
-    heatmap = get_age_heatmap_data(data, variable='deaths')
-    age_totals = data.groupby('age').sum().drop('NC').reset_index()
-
-    # plot population heatmap + barplot
-    fig = plot_heatmap_age(
-        heatmap_data=heatmap, 
-        barplot_data=age_totals, 
-        variable='deaths')
-
-    # save to image and 
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    st.image(buf)
+    st.image(figures['age_heatmap'])
     
     # Heatmap of Deaths as % of ICU and Hosp as % of pop
     st.write("""
     ## Total Deaths as % of Total ICU Admissions & as % of total Age-Group Population
     """)
-    deaths_icu, deaths_total_pop = get_deaths_ratio_data(data, pop)
-    fig = plot_heatmap_ratios_deaths(deaths_icu, deaths_total_pop)
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    st.image(buf)
+    st.image(figures['ratio_heatmap'])
+
+    # calendar heatmap by age group and week or month
+    st.write("""
+    ## Deaths per 100k by Age Group and Week or Month
+    """)
+    bucket = st.selectbox('Time bucket', list(TIME_BUCKETS))
+    st.plotly_chart(figures['{}_heatmap'.format(bucket)], use_container_width=True)
+
+##################
+# EXPLORER SECTION
+##################
+
+if rad == "Explorer":
+    st.write("""
+    ## Pivot Explorer
+    Totals over the selected date range of any variable or ratio, by any two dimensions.
+    """)
+    if store is None:
+        st.info("The explorer reads the dense store, build it with `python -m utils.app_classes`.")
+    else:
+        col1, col2, col3 = st.columns(3)
+        rows = col1.selectbox('Rows', list(PIVOT_DIMS), index=0)
+        columns = col2.selectbox('Columns', [dim for dim in PIVOT_DIMS if dim != rows], index=0)
+        value = col3.selectbox('Value', list(PIVOT_VALUES))
+        # counts per capita of the provinces and age groups of each cell, not split by sex
+        per_capita = col3.checkbox('Per 100k inhabitants',
+            disabled=PIVOT_VALUES[value][1] is not None or 'sex' in (rows, columns))
+        range_store = get_data_range(start_date, end_date)
+        pivot = get_pivot(range_store, rows, columns, value, prov_dim)
+        if per_capita:
+            population = get_pivot_population(range_store, rows, columns, province_pop_dim, prov_dim)
+            pivot = pivot / population.where(population > 0) * 1e5
+            value = '{} per 100k'.format(value)
+        st.plotly_chart(plot_pivot_heatmap(pivot, value), use_container_width=True)
+        st.dataframe(pivot)
 
 #####################
 # PREDICTIONS SECTION
 #####################
+
+if rad == "Predictions":
+    st.write("""
+    ## Forecasts of the 7-day Averages
+    Log-linear trend of the last {} days and Holt's linear trend model, fit on the
+    log counts of every series when the data is published. The bands are 95%
+    prediction intervals from the errors of the same models at past dates.
+    """.format(TREND_DAYS))
+    forecasts = load_forecasts(data_version)
+    col1, col2 = st.columns(2)
+    variable = col1.selectbox('Variable', list(DAILY_VARIABLES))
+    ages = sorted(forecasts.age.unique())
+    age = col2.selectbox('Age', ages, index=ages.index('All Ages'))
+    st.plotly_chart(plot_forecast(forecasts, variable, age), use_container_width=True)
+    rows = forecasts[(forecasts.variable == variable) & (forecasts.age == age) & (forecasts.model != 'observed')]
+    st.dataframe(rows.pivot(index='date', columns='model', values=['value', 'lower', 'upper']).round())
+
+#####################
+# DIAGNOSTICS SECTION
+#####################
+
+if rad == "Diagnostics":
+    st.write("""
+    ## Memory Diagnostics
+    Allocations traced with tracemalloc since the process started, sizes in bytes.
+    """)
+    history = pd.DataFrame(reruns)
+    if not history.empty:
+        st.write("### Traced Memory and RSS by Rerun")
+        st.line_chart(history.set_index('rerun')[['traced', 'rss']])
+        st.dataframe(history.iloc[::-1])
+    st.write("### Growth by Session")
+    st.dataframe(get_session_report())
+    st.write("### Memory Retained by Stage")
+    st.dataframe(get_stage_report())
+    st.write("""
+    ### Top Allocators
+    Take a snapshot, browse the sections, then take another one to list the
+    source lines whose allocations grew in between.
+    """)
+    if st.button('Take snapshot (slow)'):
+        top = take_snapshot()
+        if top is None:
+            st.write("First snapshot taken.")
+        else:
+            st.dataframe(top)
+    if st.button('Summarize live objects (slow)'):
+        st.dataframe(get_object_summary())
+
+# record this run for the diagnostics section
+if profiling:
+    end_rerun(get_script_run_ctx().session_id, rad)
@@ -0,0 +1,13 @@
+#!/bin/sh
+# Runs the app and warms it up. The readiness probe answers on READY_PORT:
+# /ready returns 503 until every section has been rendered once.
+set -e
+
+PORT=${PORT:-8501}
+READY_PORT=${READY_PORT:-8502}
+
+streamlit run app.py --server.port "$PORT" --server.headless true &
+APP_PID=$!
+python -m utils.app_warmup --url "ws://127.0.0.1:${PORT}/stream" --port "$READY_PORT" &
+
+wait "$APP_PID"
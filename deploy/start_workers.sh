@@ -0,0 +1,69 @@
+#!/bin/sh
+# Runs WORKERS streamlit processes behind an nginx reverse proxy on port 8501.
+# The processes share the rendered assets and the on-disk cache (DASHBOARD_CACHE_DIR).
+set -e
+
+WORKERS=${WORKERS:-$(nproc)}
+FIRST_PORT=${FIRST_PORT:-8601}
+READY_PORT=${READY_PORT:-8502}
+export DASHBOARD_CACHE_DIR=${DASHBOARD_CACHE_DIR:-/tmp/dashboard_cache}
+
+# upstream servers, one per worker
+SERVERS=""
+URLS=""
+i=0
+while [ "$i" -lt "$WORKERS" ]; do
+    PORT=$((FIRST_PORT + i))
+    streamlit run app.py --server.port "$PORT" --server.address 127.0.0.1 --server.headless true &
+    SERVERS="${SERVERS}        server 127.0.0.1:${PORT};
+"
+    URLS="${URLS} --url ws://127.0.0.1:${PORT}/stream"
+    i=$((i + 1))
+done
+
+# /ready returns 503 until every worker has rendered every section once
+python -m utils.app_warmup ${URLS} --host 127.0.0.1 --port "$READY_PORT" &
+
+# sessions are sticky: a session and the media files it references live in
+# the memory of the worker that created them. They are pinned on a cookie set
+# per browser, clients without it (the first page load) on their address, so
+# browsers behind one proxy or NAT still spread over the workers
+cat > /etc/nginx/conf.d/dashboard.conf <<CONF
+map \$cookie_dashboard_session \$session_key {
+        '' \$remote_addr;
+        default \$cookie_dashboard_session;
+}
+
+map \$cookie_dashboard_session \$session_cookie {
+        '' "dashboard_session=\$request_id; Path=/; HttpOnly; SameSite=Lax";
+        default '';
+}
+
+upstream dashboard {
+        hash \$session_key consistent;
+${SERVERS}}
+
+map \$http_upgrade \$connection_upgrade {
+        default upgrade;
+        '' close;
+}
+
+server {
+        listen 8501;
+        location = /ready {
+                proxy_pass http://127.0.0.1:${READY_PORT};
+        }
+        location / {
+                add_header Set-Cookie \$session_cookie always;
+                proxy_pass http://dashboard;
+                proxy_http_version 1.1;
+                proxy_set_header Upgrade \$http_upgrade;
+                proxy_set_header Connection \$connection_upgrade;
+                proxy_set_header Host \$host;
+                proxy_read_timeout 86400;
+        }
+}
+CONF
+rm -f /etc/nginx/sites-enabled/default
+
+exec nginx -g 'daemon off;'
@@ -0,0 +1,190 @@
+import argparse
+import gzip
+import hashlib
+import json
+import pathlib
+import pandas as pd
+import pyarrow as pa
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from utils.app_cache import DiskCache
+from utils.app_funcs import *
+from utils.app_partitions import DatePartitions
+from utils.app_store import DenseStore
+
+
+# endpoint -> function of (data, pop, params) returning a DataFrame
+ENDPOINTS = {
+    '/sma7_gby_age_date': lambda data, pop, params: get_sma7_gby_age_date(data),
+    '/wave_heatmap': lambda data, pop, params: get_wave_heatmap_data(data, params['variable']),
+    '/age_heatmap': lambda data, pop, params: get_age_heatmap_data(data, params['variable']),
+    '/hosp_ratio': lambda data, pop, params: get_ratio_table(get_hosp_ratio_data(data, pop), params),
+    '/icu_ratio': lambda data, pop, params: get_ratio_table(get_icu_ratio_data(data, pop), params),
+    '/deaths_ratio': lambda data, pop, params: get_ratio_table(get_deaths_ratio_data(data, pop), params),
+}
+
+
+def get_ratio_table(ratio_data, params):
+    """picks one of the two crosstabs returned by the get_*_ratio_data functions
+
+    Args:
+        ratio_data (tuple): (ratio to the previous stage, ratio to population)
+        params (dict): query parameters, 'table' is 'ratio' (default) or 'population'
+
+    Returns:
+        pd.DataFrame: selected crosstab
+    """
+    tables = dict(zip(('ratio', 'population'), ratio_data))
+    return tables[params.get('table', 'ratio')]
+
+
+def get_store_dir(data_dir, data_version):
+    """directory of the dense store written by the build for a data version
+
+    Args:
+        data_dir (pathlib.Path): data directory
+        data_version (string): version returned by get_data_version()
+
+    Returns:
+        pathlib.Path: store directory
+    """
+    return data_dir.parent / 'assets' / data_version / 'store'
+
+
+@lru_cache(maxsize=1)
+def load_data(data_dir, data_version, has_store):
+    """loads the dense store of a data version, the partitions if the build has not
+    written it
+
+    Args:
+        data_dir (pathlib.Path): data directory
+        data_version (string): version returned by get_data_version()
+        has_store (bool): whether the store exists, part of the cache key so
+            the store replaces the partitions as soon as the build writes it
+
+    Returns:
+        tuple(DenseStore or pd.DataFrame, pd.DataFrame): covid data and population dimension
+    """
+    if has_store:
+        data = DenseStore(get_store_dir(data_dir, data_version))
+    else:
+        data = read_covid_data(DatePartitions(data_dir / 'partitions'))
+    pop = get_population_dim(pd.read_csv(data_dir / 'population_spain_10s.csv'))
+    return data, pop
+
+
+@lru_cache(maxsize=256)
+def render(data_dir, data_version, path, query, fmt, compress):
+    """returns the encoded endpoint, cached in memory and in the on-disk cache
+    shared with the other processes
+
+    Args:
+        data_dir (pathlib.Path): data directory
+        data_version (string): version returned by get_data_version()
+        path (string): endpoint
+        query (tuple): sorted query parameters
+        fmt (string): 'json' or 'arrow'
+        compress (bool): gzip the body
+
+    Returns:
+        bytes: response body
+    """
+    key = ('api', data_version, path, query, fmt, compress)
+    return DiskCache().memoize(key, encode, data_dir, data_version, path, query, fmt, compress)
+
+
+def encode(data_dir, data_version, path, query, fmt, compress):
+    """computes an endpoint and encodes it
+
+    Args:
+        data_dir (pathlib.Path): data directory
+        data_version (string): version returned by get_data_version()
+        path (string): endpoint
+        query (tuple): sorted query parameters
+        fmt (string): 'json' or 'arrow'
+        compress (bool): gzip the body
+
+    Returns:
+        bytes: response body
+    """
+    has_store = (get_store_dir(data_dir, data_version) / 'axes.json').exists()
+    data, pop = load_data(data_dir, data_version, has_store)
+    table = ENDPOINTS[path](data, pop, dict(query))
+    table.columns = table.columns.astype(str)
+    if fmt == 'arrow':
+        arrow_table = pa.Table.from_pandas(table)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+        body = sink.getvalue().to_pybytes()
+    else:
+        body = table.to_json(orient='split', date_format='iso').encode()
+    return gzip.compress(body) if compress else body
+
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """read-only JSON/Arrow endpoints over the dashboard aggregates"""
+
+    data_dir = pathlib.Path('data')
+
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        fmt = params.pop('format', 'json')
+        if url.path not in ENDPOINTS:
+            return self.send_error_json(404, 'unknown endpoint {}'.format(url.path))
+        if fmt not in ('json', 'arrow'):
+            return self.send_error_json(400, 'unknown format {}'.format(fmt))
+        # the etag only changes with the data version
+        data_version = get_data_version(self.data_dir / 'partitions')
+        query = tuple(sorted(params.items()))
+        compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+        etag = '"{}"'.format(hashlib.sha1(repr((data_version, url.path, query, fmt, compress)).encode()).hexdigest()[:16])
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return None
+        try:
+            body = render(self.data_dir, data_version, url.path, query, fmt, compress)
+        except (KeyError, ValueError) as e:
+            return self.send_error_json(400, 'bad parameters: {}'.format(e))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json' if fmt == 'json' else 'application/vnd.apache.arrow.stream')
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+        return None
+
+
+    def send_error_json(self, code, message):
+        body = json.dumps({'error': message}).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return None
+
+
+
+
+if __name__ == '__main__':
+    # python -m utils.app_api [--host HOST] [--port PORT]
+    parser = argparse.ArgumentParser(description='serve the dashboard aggregates as JSON/Arrow')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--data-dir', type=pathlib.Path, default=pathlib.Path('data'))
+    args = parser.parse_args()
+    ApiHandler.data_dir = args.data_dir
+    server = ThreadingHTTPServer((args.host, args.port), ApiHandler)
+    print('serving on http://{}:{}'.format(args.host, args.port))
+    server.serve_forever()
@@ -0,0 +1,120 @@
+import fcntl
+import hashlib
+import os
+import pathlib
+import pickle
+import tempfile
+
+
+# shared by every app process of the box
+CACHE_DIR = pathlib.Path(os.environ.get('DASHBOARD_CACHE_DIR', 'cache'))
+CACHE_MAX_BYTES = int(os.environ.get('DASHBOARD_CACHE_MAX_MB', 512)) * 2**20
+
+
+
+class DiskCache():
+    """Process-safe on-disk cache of pickled values. Writes go to a temporary
+    file renamed over the entry, so readers never see partial entries, and
+    the least recently used entries are evicted once the cache outgrows
+    max_bytes
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        return None
+
+
+    def get_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return self.cache_dir / '{}.pkl'.format(digest)
+
+
+    def get(self, key):
+        """returns the value of a key, None if it is not cached
+
+        Args:
+            key (tuple): hashable key, its repr() identifies the entry
+
+        Returns:
+            object: cached value
+        """
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        # the modification time orders the entries for eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return value
+
+
+    def set(self, key, value):
+        """stores a value atomically and evicts old entries if needed
+
+        Args:
+            key (tuple): hashable key, its repr() identifies the entry
+            value (object): picklable value
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.get_path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.evict()
+        return None
+
+
+    def memoize(self, key, func, *args, **kwargs):
+        """returns the cached value of key, computing and storing it with
+        func(*args, **kwargs) on a miss
+
+        Args:
+            key (tuple): hashable key, must change with the arguments
+            func (callable): function computing the value
+
+        Returns:
+            object: cached or computed value
+        """
+        value = self.get(key)
+        if value is None:
+            value = func(*args, **kwargs)
+            self.set(key, value)
+        return value
+
+
+    def evict(self):
+        """deletes the least recently used entries until the cache fits in
+        max_bytes, skipped if another process is already evicting
+        """
+        with open(self.cache_dir / '.lock', 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.pkl'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        return None
@@ -0,0 +1,134 @@
+import argparse
+import pathlib
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy.signal import find_peaks
+from utils.app_funcs import *
+from utils.app_store import DenseStore
+
+
+
+
+def get_waves_reference(data):
+    """wave of every row as segmented before get_wave_labels(): peaks of the
+    pandas sma7, the minimum between two peaks as frontier and pd.cut
+
+    Args:
+        data (pd.DataFrame): covid dataset returned by get_data()
+
+    Returns:
+        np.ndarray: wave of every row
+    """
+    daily_totals = data.groupby('date', as_index=False).cases.sum()
+    daily_totals['dailyCases'] = daily_totals.cases.rolling(WAVE_WINDOW).mean().fillna(0).astype(int)
+    peaks, _ = find_peaks(x = daily_totals.dailyCases, width=WAVE_WIDTH)
+    peaks_array = daily_totals.iloc[peaks].date.values
+    valleys = []
+    for i in range(1, peaks_array.size):
+        mask = daily_totals.date.between(peaks_array[i - 1], peaks_array[i])
+        valleys.append(daily_totals[mask].dailyCases.idxmin())
+    wave_dates = np.insert(daily_totals.iloc[valleys].date.values, 0, data.date.min())
+    wave_dates = np.insert(wave_dates, wave_dates.size, data.date.max())
+    waves = pd.cut(
+        data.date,
+        bins=wave_dates,
+        right=True,
+        include_lowest=True,
+        labels=range(1, wave_dates.size),
+        )
+    return waves.astype(int).values
+
+
+def sort_frame(frame, by):
+    """sorts a table on some columns and drops its index, so two tables
+    built in a different row order compare equal
+
+    Args:
+        frame (pd.DataFrame): table to compare
+        by (list): columns to sort on
+
+    Returns:
+        pd.DataFrame: sorted table
+    """
+    frame = frame.assign(**{column: frame[column].astype(str) for column in by if column != 'date'})
+    return frame.sort_values(by, ignore_index=True).rename_axis(columns=None)
+
+
+def check_sma(data):
+    """get_sma() against the pandas rolling mean truncated to integers"""
+    daily = data.groupby('date').cases.sum()
+    expected = daily.rolling(7).mean().fillna(0).astype(int).values
+    np.testing.assert_array_equal(get_sma(daily.values, 7), expected)
+
+
+def check_sma7_gby_age_date(data, store):
+    """get_sma7_gby_age_date() on the store against the DataFrame"""
+    columns = ['age', 'date'] + list(DAILY_VARIABLES.values())
+    expected = sort_frame(get_sma7_gby_age_date(data)[columns], ['age', 'date'])
+    result = sort_frame(get_sma7_gby_age_date(store)[columns], ['age', 'date'])
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def check_totals_age_wave(data, store):
+    """get_totals_age_wave() on the store against the DataFrame"""
+    columns = ['age', 'wave'] + list(DAILY_VARIABLES)
+    expected = sort_frame(get_totals_age_wave(data)[columns], ['age', 'wave'])
+    result = sort_frame(get_totals_age_wave(store)[columns], ['age', 'wave'])
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def check_slice_dates(data, store):
+    """totals of a slice_dates() view against the rows of the same dates"""
+    dates = store.axes['date']
+    start_date, end_date = dates[dates.size // 3], dates[2 * dates.size // 3]
+    view = store.slice_dates(start_date, end_date)
+    rows = get_date_slice(data, start_date, end_date)
+    columns = ['age', 'wave'] + list(DAILY_VARIABLES)
+    expected = sort_frame(get_totals_age_wave(rows)[columns], ['age', 'wave'])
+    result = sort_frame(get_totals_age_wave(view)[columns], ['age', 'wave'])
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    # the daily sums of the view are the dates of the range of the parent
+    np.testing.assert_array_equal(view.sum(('age', 'date', 'variable')), rows.groupby(
+        ['age', 'date'])[list(DAILY_VARIABLES)].sum().values.reshape(view.axes['age'].size, -1, 4))
+
+
+def check_wave_labels(data):
+    """get_waves() against the pd.cut segmentation it replaced"""
+    np.testing.assert_array_equal(get_waves(data.copy()).wave.values, get_waves_reference(data))
+
+
+def run_checks(n_days=900, seed=0):
+    """runs every check on a synthetic dataset
+
+    Args:
+        n_days (int, optional): days of synthetic data
+        seed (int, optional): random seed
+
+    Returns:
+        list: names of the checks run, an AssertionError is raised on the first mismatch
+    """
+    prov = pd.read_csv(pathlib.Path('data') / 'provincias.csv', keep_default_na=False)
+    data = get_synthetic_data(prov, n_days, seed)
+    check_sma(data)
+    check_wave_labels(data)
+    data = get_waves(data)
+    with tempfile.TemporaryDirectory() as store_dir:
+        store = DenseStore.build(data, store_dir, list(DAILY_VARIABLES))
+        check_sma7_gby_age_date(data, store)
+        check_totals_age_wave(data, store)
+        check_slice_dates(data, store)
+        del store
+    return ['sma', 'wave_labels', 'sma7_gby_age_date', 'totals_age_wave', 'slice_dates']
+
+
+
+
+if __name__ == '__main__':
+    # equivalence checks: python -m utils.app_checks [--days N] [--seed S]
+    parser = argparse.ArgumentParser(description='compare the dense store and vectorized paths to pandas')
+    parser.add_argument('--days', type=int, default=900, help='days of synthetic data')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+    for name in run_checks(args.days, args.seed):
+        print('{}: ok'.format(name))
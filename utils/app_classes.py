@@ -1,57 +1,47 @@
+import argparse
 import pathlib
 import pandas as pd
-from app_funcs import *
+from concurrent.futures import ProcessPoolExecutor
+from utils.app_funcs import *
+from utils.app_partitions import DatePartitions, REVISION_DAYS
+from utils.app_store import DenseStore
 
 
 
-def DataHandler():
+class DataHandler():
 
-    def __init__(self, data_source, data_dir):
+    def __init__(self, data_source, data_dir, assets_dir=None):
         self.data_source = data_source
-        self.data_dir = data_dir
-        self.processed_data_dir = data_dir / 'processed'
+        self.data_dir = pathlib.Path(data_dir)
+        self.processed_data_dir = self.data_dir / 'processed'
+        self.assets_dir = pathlib.Path(assets_dir or self.data_dir.parent / 'assets')
         self.last_date = None
-        self.covid_data_path = None
+        # monthly partitions of the downloaded data and the waves, the only copy of the data
+        self.partitions_dir = self.data_dir / 'partitions'
         return None
 
 
-    def update_covid_data(self):
-        # read data from source url and format
-        url = self.data_source
-        data = pd.read_csv(url).convert_dtypes()
-        # TODO add a format checker before running this
-        data.fecha = pd.to_datetime(data.fecha)
-        col_rename = {
-            'provincia_iso': 'province',
-            'sexo':'sex',
-            'grupo_edad':'age',
-            'fecha':'date',
-            'num_casos':'cases',
-            'num_hosp':'hospitalizations',
-            'num_uci':'icu',
-            'num_def':'deaths',
-        }
-        data = data.rename(col_rename, axis = 'columns')
-        # remap ages
-        dict_remap = dict(zip(
-            data.age.unique(), 
-            ['0s', '10s', '20s', '30s', '40s', '50s', '60s', '70s', '80+', 'NC']))
-        data.age = data.age.replace(dict_remap)
-        # find first case
-        min_date = data.groupby('date', as_index=False).sum().query("cases > 0").date.min()
-        # keep only values gte min_date
-        date_mask = data.date >= min_date
-        data = data.loc[date_mask, :]
-        # define export path
-        self.covid_data_path = self.data_dir / 'covid_19_spain.csv'
-        data.to_csv(self.covid_data_path, sep = ';', index=False)
+    def update_covid_data(self, revision_days=REVISION_DAYS):
+        # read data from source url, rejected before anything is written if a check fails
+        prov = pd.read_csv(self.data_dir / 'provincias.csv', keep_default_na=False)
+        data = get_data(self.data_source, prov.codigoProvincia.tolist() + ['NC'])
+        # only the months in the revision window that changed are rewritten
+        written = DatePartitions(self.partitions_dir).write(data, revision_days)
         # update last date attribute
         self.last_date = data.date.max()
-        return 'finished gathering and formatting covid data'
+        return 'finished gathering covid data, rewrote partitions {}'.format(written or 'none')
 
 
-    def compute_sma7_gby_date(self):
-        data = pd.read_csv(self.covid_data_path, sep = ';')
+    def compute_wave_variable(self):
+        # the waves only need the daily cases, the other columns are not read
+        partitions = DatePartitions(self.partitions_dir)
+        daily_cases = partitions.read(columns=['date', 'cases']).groupby('date').cases.sum()
+        waves = pd.Series(get_wave_labels(daily_cases.values), index=daily_cases.index)
+        partitions.write_waves(waves)
+        return None
+
+
+    def compute_sma7_gby_date(self, data):
         data_gby = data.groupby('date').agg(
             dailyCases = ('cases', sum),
             dailyHospitalizations = ('hospitalizations', sum),
@@ -64,8 +54,7 @@ def DataHandler():
         return None
 
 
-    def compute_sma7_bgy_age_date(self):
-        data = pd.read_csv(self.covid_data_path, sep = ';')
+    def compute_sma7_bgy_age_date(self, data):
         data_gby = data.groupby(['age', 'date']).agg(
             dailyCases = ('cases', sum),
             dailyHospitalizations = ('hospitalizations', sum),
@@ -82,41 +71,117 @@ def DataHandler():
         data_out.to_csv(out_path, index = False, sep = ';')
         return None
 
-    def compute_data_assets(self):
+
+    def compute_data_assets(self, n_jobs=None):
+        """computes the processed data and pre-renders every section to
+        assets_dir/<data version>/<variable>, one worker process per section
+
+        Args:
+            n_jobs (int, optional): number of worker processes, defaults to
+                the number of cores
+
+        Returns:
+            pathlib.Path: directory holding the assets of this data version
+        """
+        # nothing to build from, e.g. a fresh checkout where no data was downloaded
+        partitions = DatePartitions(self.partitions_dir)
+        if not partitions.manifest['partitions']:
+            raise SystemExit('no covid data in {}, download it with '
+                '`python -m utils.app_classes --update`'.format(self.partitions_dir))
+        self.processed_data_dir.mkdir(parents=True, exist_ok=True)
         self.compute_wave_variable()
-        self.compute_sma7_gby_date()
-        self.compute_sma7_bgy_age_date()
+        # the partitions are read once into the dense store shared by the workers
+        data = read_covid_data(partitions)
+        self.compute_sma7_gby_date(data)
+        self.compute_sma7_bgy_age_date(data)
+        version_dir = self.assets_dir / get_data_version(self.partitions_dir)
+        store_dir = version_dir / 'store'
+        DenseStore.build(data, store_dir, list(DAILY_VARIABLES))
+        del data
+        # render sections and fit the forecasts in parallel
+        sections = [
+            VariableSection(version_dir, self.data_dir, variable)
+            for variable in DAILY_VARIABLES
+            ]
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [
+                executor.submit(section.compute_assets, store_dir)
+                for section in sections
+                ]
+            futures.append(executor.submit(self.compute_forecasts, store_dir, version_dir))
+            for future in futures:
+                future.result()
+        return version_dir
+
+
+    def compute_forecasts(self, store_dir, version_dir):
+        """fits every forecast model to every series and writes the forecasts
+        to version_dir/forecasts.csv
+
+        Args:
+            store_dir (pathlib.Path): directory of the DenseStore of the covid data
+            version_dir (pathlib.Path): directory holding the assets of this data version
+
+        Returns:
+            pathlib.Path: forecasts file
+        """
+        out_path = pathlib.Path(version_dir) / 'forecasts.csv'
+        get_forecasts(DenseStore(store_dir)).to_csv(out_path, sep=';', index=False)
+        return out_path
+
 
-    
 
 
-def VariableSection():
+class VariableSection():
 
 
     def __init__(self, assets_dir, data_dir, section_name):
-        """Initializes an instance of a section 
+        """Initializes an instance of a section and creates its assets directory
 
         Args:
             assets_dir (pathlib.Path): parent path for assets
             data_dir (pathlib.Path): parent path for data
             section_name (string): string with the variable to watch
-
-        Returns:
-            init_message (string): init message
         """
-        self.assets_dir = assets_dir
+        self.assets_dir = pathlib.Path(assets_dir)
         self.section_name = section_name
-        self.data_dir = data_dir
+        self.data_dir = pathlib.Path(data_dir)
         # create subdir for variable section in assets dir
-        section_dir = self.assets_dir / self.section_name
-        pathlib.Path(section_dir).mkdir(parents=True, exist_ok=True)
-        init_message = 'created section directory at {}'.format(section_dir)
-        return init_message
+        self.section_dir = self.assets_dir / self.section_name
+        pathlib.Path(self.section_dir).mkdir(parents=True, exist_ok=True)
+        return None
 
 
-    def compute_assets(self, covid_csv_key):
-        # connect to covid data time series csv
-        covid_csv_path = self.data_path / covid_csv_key
-        covid_data = pd.read_csv(covid_csv_path, sep = ';')
-        #
-        return None
+    def compute_assets(self, store_dir):
+        """renders every figure and data table of the section to its directory
+
+        Args:
+            store_dir (pathlib.Path): directory of the DenseStore of the covid data
+
+        Returns:
+            pathlib.Path: section directory
+        """
+        # connect to the memory-mapped covid data
+        covid_data = DenseStore(store_dir)
+        pop = get_population_dim(pd.read_csv(self.data_dir / 'population_spain_10s.csv'))
+        figures, tables = compute_section_assets(covid_data, pop, self.section_name)
+        save_section_assets(figures, tables, self.section_dir)
+        return self.section_dir
+
+
+
+
+if __name__ == '__main__':
+    # build command: python -m utils.app_classes [--update] [--jobs N]
+    parser = argparse.ArgumentParser(description='pre-render the dashboard assets')
+    parser.add_argument('--data-dir', type=pathlib.Path, default=pathlib.Path('data'))
+    parser.add_argument('--assets-dir', type=pathlib.Path, default=pathlib.Path('assets'))
+    parser.add_argument('--update', action='store_true', help='download the data first')
+    parser.add_argument('--revision-days', type=int, default=REVISION_DAYS,
+        help='days before the last date the source may have revised')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes')
+    args = parser.parse_args()
+    handler = DataHandler(DATA_SOURCE, args.data_dir, args.assets_dir)
+    if args.update:
+        print(handler.update_covid_data(args.revision_days))
+    print('assets written to {}'.format(handler.compute_data_assets(args.jobs)))
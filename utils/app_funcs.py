@@ -1,74 +1,426 @@
+import hashlib
+import pathlib
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pandas as pd 
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
 import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+from functools import lru_cache
+from io import BytesIO
 from scipy.signal import find_peaks
+from utils.app_profile import profiled
+from utils.app_store import DenseStore
+from utils.app_validation import read_feed
+
+
+DATA_SOURCE = 'https://cnecovid.isciii.es/covid19/resources/casos_hosp_uci_def_sexo_edad_provres.csv'
+# age groups of the covid dataset, NC excluded
+AGE_GROUPS = ['0s', '10s', '20s', '30s', '40s', '50s', '60s', '70s', '80+']
+# 10-year age groups as sums of the 5-year bands of population_spain_5s.csv
+BANDS_5S_TO_10S = {
+    '0s': ['0-4', '5-9'],
+    '10s': ['10-14', '15-19'],
+    '20s': ['20-24', '25-29'],
+    '30s': ['30-34', '35-39'],
+    '40s': ['40-44', '45-49'],
+    '50s': ['50-54', '55-59'],
+    '60s': ['60-64', '65-69'],
+    '70s': ['70-74', '75-79'],
+    '80+': ['80-84', '85-89', '90-94', '95-99', '100+'],
+}
+# sidebar sections of the app
+SECTIONS = ['Overview', 'Cases', 'Hospitalizations', 'ICU Admissions', 'Deaths', 'Explorer', 'Predictions']
+# observed variable -> name of its daily sma7 column
+DAILY_VARIABLES = {
+    'cases': 'dailyCases',
+    'hospitalizations': 'dailyHospitalizations',
+    'icu': 'dailyICU',
+    'deaths': 'dailyDeaths',
+}
+# sex codes of the covid dataset
+SEX_LABELS = {'H': 'Men', 'M': 'Women', 'NC': 'NC'}
+# pivot dimension -> axis of the dense store it rolls up
+PIVOT_DIMS = {
+    'age': 'age',
+    'sex': 'sex',
+    'wave': 'date',
+    'month': 'date',
+    'province': 'province',
+    'autonomousCommunity': 'province',
+}
+# pivot value -> (numerator, denominator) variables, counts have no denominator
+PIVOT_VALUES = {
+    'cases': ('cases', None),
+    'hospitalizations': ('hospitalizations', None),
+    'icu': ('icu', None),
+    'deaths': ('deaths', None),
+    'hospitalizations / cases': ('hospitalizations', 'cases'),
+    'icu / hospitalizations': ('icu', 'hospitalizations'),
+    'deaths / icu': ('deaths', 'icu'),
+    'deaths / cases': ('deaths', 'cases'),
+}
+# time buckets of the calendar heatmaps -> label of every date
+TIME_BUCKETS = {
+    'week': lambda dates: dates.strftime('%G-W%V'),
+    'month': lambda dates: dates.strftime('%Y-%m'),
+}
+# default wave detection parameters, see get_wave_labels()
+WAVE_WIDTH = 20
+WAVE_PROMINENCE = 0.0
+WAVE_WINDOW = 7
+# days forecast after the last date
+FORECAST_DAYS = 28
+# last days the log-linear trend and the Holt model are fit on
+TREND_DAYS = 28
+HOLT_DAYS = 120
+# past origins, one week apart, whose errors give the prediction intervals
+BACKTEST_ORIGINS = 8
+# days of observed history stored with the forecasts
+HISTORY_DAYS = 120
+# smoothing parameters searched when fitting the Holt model
+HOLT_ALPHAS = np.linspace(0.1, 0.9, 9)
+HOLT_BETAS = np.linspace(0.05, 0.5, 10)
+# normal quantile of the 95% prediction intervals
+Z_95 = 1.96
 
 
 # GATHERING FUNCTIONS
 ######################
 
-def get_data(): # added to class DataHandler
-    """gathers data from the Spanish Ministry of Health and formats it 
+def get_data(source=DATA_SOURCE, provinces=None): # added to class DataHandler
+    """gathers data from the Spanish Ministry of Health, validating and
+    formatting it chunk by chunk with read_feed()
+
+    Args:
+        source (string, optional): url or path of the feed csv
+        provinces (list, optional): valid province codes, not checked if None
+
+    Raises:
+        ValueError: the feed failed a check
 
     Returns:
         data(pd.DataFrame): gathered dataframe with some basic formatting
     """
-    url = 'https://cnecovid.isciii.es/covid19/resources/casos_hosp_uci_def_sexo_edad_provres.csv'
-    data = pd.read_csv(url, keep_default_na=False).convert_dtypes()
-    data.fecha = pd.to_datetime(data.fecha)
-    # renames
-    col_rename = {
-        'provincia_iso': 'province',
-        'sexo':'sex',
-        'grupo_edad':'age',
-        'fecha':'date',
-        'num_casos':'cases',
-        'num_hosp':'hospitalizations',
-        'num_uci':'icu',
-        'num_def':'deaths',
-    }
-    data = data.rename(col_rename, axis = 'columns')
-    # remap ages
-    dict_remap = dict(zip(
-        data.age.unique(), 
-        ['0s', '10s', '20s', '30s', '40s', '50s', '60s', '70s', '80+', 'NC']))
-    data.age = data.age.replace(dict_remap)
-    # find first case
-    min_date = data.groupby('date', as_index=False).sum().query("cases > 0").date.min()
-    # keep only values gte min_date
-    date_mask = data.date >= min_date
-    data = data.loc[date_mask, :]
+    data = read_feed(source, provinces)
+    # keep only values from the first case, the feed is sorted by date
+    min_date = data.date.values[data.cases.values > 0].min()
+    return data[data.date.values >= min_date].reset_index(drop=True)
+
+
+def get_synthetic_data(prov_data, n_days=900, seed=0):
+    """generates a covid dataset with the shape of the one returned by
+    get_data(), with cases following a few waves, for load tests
+
+    Args:
+        prov_data (pd.DataFrame): dataframe with province info
+        n_days (int, optional): number of days
+        seed (int, optional): random seed
+
+    Returns:
+        pd.DataFrame: synthetic covid dataset sorted by date
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-03-01', periods=n_days, freq='D')
+    provinces = list(prov_data.codigoProvincia) + ['NC']
+    index = pd.MultiIndex.from_product(
+        [dates, provinces, ['H', 'M', 'NC'], AGE_GROUPS + ['NC']],
+        names=['date', 'province', 'sex', 'age'])
+    data = index.to_frame(index=False)
+    # one gaussian bump per 150 days
+    t = np.arange(n_days)
+    peaks = np.arange(75, n_days, 150)
+    daily = 5 + 60 * np.exp(-0.5 * ((t[:, None] - peaks) / 20) ** 2).sum(axis=1)
+    data['cases'] = rng.poisson(np.repeat(daily, len(index) // n_days))
+    data['hospitalizations'] = rng.binomial(data.cases, 0.08)
+    data['icu'] = rng.binomial(data.hospitalizations, 0.1)
+    data['deaths'] = rng.binomial(data.hospitalizations, 0.12)
+    return data[['province', 'sex', 'age', 'date', 'cases', 'hospitalizations', 'icu', 'deaths']]
+
+
+@profiled
+def read_covid_data(partitions, start_date=None, end_date=None):
+    """reads the covid dataset stored by DatePartitions within a date range,
+    only the monthly partitions the range touches are opened
+
+    Args:
+        partitions (DatePartitions): partitions of the covid dataset
+        start_date (datetime.date, optional): first date, unbounded if None
+        end_date (datetime.date, optional): last date, unbounded if None
+
+    Returns:
+        pd.DataFrame: date-sorted covid dataset with the wave variable and
+            categorical provinces
+    """
+    data = partitions.read(start_date, end_date)
+    data['wave'] = partitions.read_waves().reindex(data.date).values
     return data
 
 
+def map_categories(categorical, mapping):
+    """maps a categorical series through a dict-like once per category instead
+    of once per row, values missing from the mapping are kept as they are
+
+    Args:
+        categorical (pd.Series): series with a category dtype
+        mapping (pd.Series): category -> new value
+
+    Returns:
+        pd.Series: categorical series with the mapped values
+    """
+    categories = categorical.cat.categories
+    mapped = mapping.reindex(categories)
+    mapped = mapped.fillna(pd.Series(categories, index=categories))
+    new_categories = pd.Index(mapped.unique())
+    # code -1 (missing value) indexes the appended -1 and stays missing
+    lookup = np.append(new_categories.get_indexer(mapped), -1)
+    codes = lookup[categorical.cat.codes.values]
+    return pd.Series(
+        pd.Categorical.from_codes(codes, new_categories),
+        index=categorical.index,
+        name=categorical.name,
+        )
+
+
+@profiled
 def map_province(covid_data, prov_data):
-    """Maps the province to its autonomous community on covid dataset
+    """Maps the province to its autonomous community and to its integer key in
+    get_province_dim() on covid dataset, the mapping is done per category
 
     Args:
         covid_data (pd.DataFrame): covid data gathered by get_data()
         prov_data (pd.DataFrame): dataframe with province info
     Returns:
-        pd.DataFrame: dataframe with the autonomousComunity variable
+        pd.DataFrame: dataframe with the autonomousComunity and provinceKey variables
     """
-    ccaa_map = prov_data.set_index('codigoProvincia').nombreCCAA
-    covid_data['autonomousCommunity'] = covid_data.province.str.strip().replace(ccaa_map)
+    # codes are stripped by the feed validation
+    province = covid_data.province.astype('category')
+    covid_data['province'] = province
+    prov_data = prov_data.set_index('codigoProvincia')
+    covid_data['autonomousCommunity'] = map_categories(province, prov_data.nombreCCAA)
+    # provinces without a key (NC) get -1
+    keys = get_province_keys(province.cat.categories, prov_data.reset_index())
+    covid_data['provinceKey'] = np.append(keys, -1)[province.cat.codes.values]
     return covid_data
 
 
+def get_province_keys(provinces, prov_data):
+    """integer key in get_province_dim() of province codes, -1 for codes
+    without a province (NC)
+
+    Args:
+        provinces (pd.Index): province codes
+        prov_data (pd.DataFrame): dataframe with province info, or the province
+            dimension returned by get_province_dim()
+
+    Returns:
+        np.ndarray: int16 key of every code
+    """
+    if 'codigoINE' in prov_data.columns:
+        codes = prov_data.set_index('codigoProvincia').codigoINE
+    else:
+        codes = prov_data.reset_index().set_index('codigoProvincia').provinceKey
+    return codes.reindex(provinces).fillna(-1).astype('int16').values
+
+
+def get_province_dim(prov_data, pop_data):
+    """builds the province dimension table, joinable on the provinceKey
+    variable added by map_province()
+
+    Args:
+        prov_data (pd.DataFrame): dataframe with province info
+        pop_data (pd.DataFrame): population by province and age group
+
+    Returns:
+        pd.DataFrame: province code, name, autonomous community and total
+            population indexed by the integer INE province code
+    """
+    population = pop_data.query("age == 'total'").set_index('provinciaINE').population
+    dim = prov_data.set_index('codigoINE').rename_axis('provinceKey').sort_index()
+    dim['population'] = population.reindex(dim.index)
+    return dim
+
+
+# POPULATION FUNCTIONS
+######################
+
+def get_population_dim(pop_data):
+    """pivots a population dataset to a province x age band table, built once
+    so per-capita normalizations are array broadcasts
+
+    Args:
+        pop_data (pd.DataFrame): either population_spain_10s.csv (long format,
+            10-year age groups) or population_spain_5s.csv (wide format,
+            5-year age bands)
+
+    Returns:
+        pd.DataFrame: population indexed by provinceKey with one column per age band
+    """
+    if 'age' in pop_data.columns:
+        dim = pop_data.pivot(index='provinciaINE', columns='age', values='population')
+        dim = dim[AGE_GROUPS]
+    else:
+        bands = [column for column in pop_data.columns if column[0].isdigit()]
+        dim = pop_data.set_index('provinciaINE')[bands]
+    return dim.rename_axis(index='provinceKey', columns='age').sort_index()
+
+
+def rebin_population(pop_dim, bins=BANDS_5S_TO_10S):
+    """sums the age bands of a population dimension into wider bands
+
+    Args:
+        pop_dim (pd.DataFrame): population dimension returned by get_population_dim()
+        bins (dict, optional): new band -> list of bands it sums, defaults to
+            5-year bands to the 10-year age groups of the covid dataset
+
+    Returns:
+        pd.DataFrame: population indexed by provinceKey with one column per new band
+    """
+    matrix = np.zeros((pop_dim.columns.size, len(bins)), dtype=pop_dim.values.dtype)
+    for i, bands in enumerate(bins.values()):
+        rows = pop_dim.columns.get_indexer(bands)
+        if (rows < 0).any():
+            raise ValueError('unknown age bands in {}'.format(bands))
+        matrix[rows, i] = 1
+    return pd.DataFrame(
+        pop_dim.values @ matrix,
+        index=pop_dim.index,
+        columns=pd.Index(list(bins), name='age'),
+        )
+
+
+def get_age_population(pop_dim, province_keys=None):
+    """total population by age band
+
+    Args:
+        pop_dim (pd.DataFrame): population dimension returned by get_population_dim()
+        province_keys (list, optional): provinceKey values to add up, all if None
+
+    Returns:
+        pd.Series: population by age band
+    """
+    values = pop_dim.values if province_keys is None else pop_dim.reindex(province_keys).values
+    return pd.Series(np.nansum(values, axis=0), index=pop_dim.columns, name='population')
+
+
+def normalize_to_population(xtab, pop_dim, province_keys=None):
+    """divides a crosstab with age bands as columns by the population of each band
+
+    Args:
+        xtab (pd.DataFrame): crosstab with age bands as columns
+        pop_dim (pd.DataFrame): population dimension returned by get_population_dim()
+        province_keys (list, optional): provinceKey values to add up, all if None
+
+    Returns:
+        pd.DataFrame: crosstab normalized to population
+    """
+    age_pop = get_age_population(pop_dim, province_keys).reindex(xtab.columns)
+    return xtab / age_pop.values
+
+
 # DATA PROCESSING FUNCTIONS
 ############################
 
+def get_sma(counts, window=7, axis=-1):
+    """simple moving average of daily counts, truncated to integers and 0 for
+    the first window - 1 days like rolling(window).mean().fillna(0).astype(int)
+
+    Args:
+        counts (np.ndarray): integer daily counts
+        window (int, optional): days averaged
+        axis (int, optional): date axis
+
+    Returns:
+        np.ndarray: moving average of the counts
+    """
+    counts = np.moveaxis(counts, axis, -1)
+    cumsum = np.cumsum(counts, axis=-1, dtype=np.int64)
+    sma = np.zeros_like(cumsum)
+    sma[..., window - 1:] = cumsum[..., window - 1:]
+    sma[..., window:] -= cumsum[..., :-window]
+    return np.moveaxis(sma // window, -1, axis)
+
+
+def get_sma7(counts, axis=-1):
+    """7-day simple moving average of daily counts, see get_sma()
+
+    Args:
+        counts (np.ndarray): integer daily counts
+        axis (int, optional): date axis
+
+    Returns:
+        np.ndarray: sma7 of the counts
+    """
+    return get_sma(counts, 7, axis)
+
+
+def get_totals_age_wave(data):
+    """totals of the observed variables for every age group (NC excluded) and wave
+
+    Args:
+        data (pd.DataFrame or DenseStore): covid dataset with the wave variable
+
+    Returns:
+        pd.DataFrame: age, wave and one column per observed variable
+    """
+    if isinstance(data, DenseStore):
+        # sum each wave's run of dates of the (age, date, variable) array
+        starts, waves = data.wave_starts()
+        totals = np.add.reduceat(data.sum(('age', 'date', 'variable')), starts, axis=1)
+        index = pd.MultiIndex.from_product([data.axes['age'], waves], names=['age', 'wave'])
+        totals_age_wave = pd.DataFrame(
+            totals.reshape(-1, totals.shape[-1]),
+            index=index,
+            columns=data.axes['variable'],
+            ).reset_index()
+    else:
+        totals_age_wave = data.groupby(['age', 'wave'], as_index = False)[list(DAILY_VARIABLES)].sum()
+    # drop NC age
+    mask = totals_age_wave.age != 'NC'
+    return totals_age_wave[mask]
+
+
+def get_totals(data, by):
+    """totals of the observed variables by age group or by wave
+
+    Args:
+        data (pd.DataFrame or DenseStore): covid dataset with the wave variable
+        by (string): 'age' or 'wave'
+
+    Returns:
+        pd.DataFrame: totals indexed by the by variable
+    """
+    if not isinstance(data, DenseStore):
+        return data.groupby(by)[list(DAILY_VARIABLES)].sum()
+    if by == 'age':
+        totals, index = data.sum(('age', 'variable')), data.axes['age']
+    else:
+        starts, waves = data.wave_starts()
+        totals = np.add.reduceat(data.sum(('date', 'variable')), starts, axis=0)
+        index = pd.Index(waves, name='wave')
+    return pd.DataFrame(totals, index=index, columns=data.axes['variable'])
+
+
+@profiled
 def get_sma7_gby_date(data):
     """Takes the covid dataset and returns the daily 7-day moving average
 
     Args:
-        data (pd.DataFrame): covid dataset returned by get_data()
+        data (pd.DataFrame or DenseStore): covid dataset returned by get_data()
 
     Returns:
         pd.DataFrame: sma7 of observed variables
     """
+    if isinstance(data, DenseStore):
+        by_date = pd.DataFrame(
+            get_sma7(data.sum(('date', 'variable')), axis=0),
+            index=data.axes['date'],
+            columns=[DAILY_VARIABLES[variable] for variable in data.axes['variable']],
+            )
+        return by_date.reset_index()
     by_date = data.groupby('date').agg(
         dailyCases = ('cases', sum),
         dailyHospitalizations = ('hospitalizations', sum),
@@ -78,15 +430,24 @@ def get_sma7_gby_date(data):
     return by_date
 
 
+@profiled
 def get_sma7_gby_age_date(data):
     """groups by age and date and calculates the daile 7day-sma for each age group
 
     Args:
-        data (pd.DataFrame): covid dataset returned by get_data()
+        data (pd.DataFrame or DenseStore): covid dataset returned by get_data()
 
     Returns:
         pd.DataFrame: sma7 by age and date of observed variables
     """
+    if isinstance(data, DenseStore):
+        sma7 = get_sma7(data.sum(('age', 'date', 'variable')), axis=1)
+        columns = [DAILY_VARIABLES[variable] for variable in data.axes['variable']]
+        index = pd.MultiIndex.from_product([data.axes['age'], data.axes['date']], names=['age', 'date'])
+        by_age = pd.DataFrame(sma7.reshape(-1, sma7.shape[-1]), index=index, columns=columns)
+        all_ages = pd.DataFrame(sma7.sum(axis=0), index=data.axes['date'], columns=columns)
+        all_ages['age'] = 'All Ages'
+        return pd.concat([by_age.reset_index(), all_ages.reset_index()])
     # get daily data by age group
     by_age = data.groupby(['age', 'date']).agg(
         dailyCases = ('cases', sum),
@@ -104,57 +465,58 @@ def get_sma7_gby_age_date(data):
     return data_out
 
 
-def get_waves(get_sma7_gby_date, data):
-    """_summary_
+def get_wave_labels(daily_cases, width=WAVE_WIDTH, prominence=WAVE_PROMINENCE, window=WAVE_WINDOW):
+    """segments the daily cases into waves: peaks of the smoothed series are
+    found and the minimum between two peaks is the frontier of their waves
+
+    Args:
+        daily_cases (np.ndarray): cases of every date, all ages
+        width (int, optional): minimum width of a peak in days
+        prominence (float, optional): minimum prominence of a peak as a share
+            of the highest smoothed value, 0 for no minimum
+        window (int, optional): days of the moving average smoothing the cases
+
+    Returns:
+        np.ndarray: wave of every date, from 1
+    """
+    smoothed = get_sma(np.asarray(daily_cases), window)
+    peaks, _ = find_peaks(
+        x = smoothed,
+        width = width,
+        prominence = prominence * smoothed.max() if prominence else None,
+        )
+    # a frontier belongs to the wave before it
+    valleys = [peaks[i - 1] + np.argmin(smoothed[peaks[i - 1]:peaks[i] + 1]) for i in range(1, peaks.size)]
+    return np.searchsorted(valleys, np.arange(smoothed.size), side='left') + 1
+
+
+def get_waves(data, width=WAVE_WIDTH, prominence=WAVE_PROMINENCE, window=WAVE_WINDOW):
+    """adds the wave variable to the covid dataset, see get_wave_labels()
 
     Args:
-        get_sma7_gby_date (python function): gets the daily sma7 of observed variabels
         data (pd.DataFrame): covid dataset returned by get_data()
+        width (int, optional): minimum width of a peak in days
+        prominence (float, optional): minimum prominence of a peak as a share
+            of the highest smoothed value, 0 for no minimum
+        window (int, optional): days of the moving average smoothing the cases
 
     Returns:
         pd.DataFrame: dataframe with the added "waves" column
     """
     # get daily totals
-    daily_totals = get_sma7_gby_date(data)
-    # get peak indices
-    peaks, _ = find_peaks(
-        x = daily_totals.dailyCases,
-        width=20
-        )
-    # get peak dates
-    peak_dates = daily_totals.iloc[peaks].date
-    peaks_array = peak_dates.values
-    # find valleys as minimum between peaks
-    valleys = []
-    for i in range(1,peaks_array.size):
-        # subset dataset between peaks
-        lower_bound = peaks_array[i-1]
-        upper_bound = peaks_array[i]
-        mask = daily_totals.date.between(lower_bound, upper_bound)
-        # get index of the minumum
-        valleys.append(daily_totals[mask].dailyCases.idxmin())
-    # get dates from the indices list
-    valley_dates = daily_totals.iloc[valleys].date.values
-    # inserts required for pd.cut
-    wave_dates = np.insert(valley_dates, 0, data.date.min())
-    wave_dates = np.insert(wave_dates, wave_dates.size, data.date.max())
-    # create the numerical variable wave 
-    data['wave'] = pd.cut(
-        data.date, 
-        bins=wave_dates,
-        right=True,
-        include_lowest = True,
-        labels = range(1, wave_dates.size)
-        )
+    daily_cases = data.groupby('date').cases.sum()
+    labels = get_wave_labels(daily_cases.values, width, prominence, window)
+    data['wave'] = labels[daily_cases.index.get_indexer(data.date)]
     return data
 
 
+@profiled
 def get_wave_heatmap_data(data, variable):
     """groups the covid dataset by age group and wave and creates a contingency
     table representing all age-wave combinations normalized to wave totals
 
     Args:
-        data (pd.DataFrame): covid dataset returned by get_data()
+        data (pd.DataFrame or DenseStore): covid dataset returned by get_data()
         variable (string): observed variable
             'cases' covid cases
             'hospitalizations': hospitalizations 
@@ -164,11 +526,8 @@ def get_wave_heatmap_data(data, variable):
     Returns:
         pandas.DataFrame: contingency table for the age group and wave variables
     """
-    # gby age and wave
-    totals_age_wave = data.groupby(['age', 'wave'], as_index = False).sum()
-    # drop NC age
-    mask = totals_age_wave.age != 'NC'
-    totals_age_wave = totals_age_wave[mask]
+    # gby age and wave, NC age dropped
+    totals_age_wave = get_totals_age_wave(data)
     # get cases dataframe
     heatmap_age_wave = pd.crosstab(
         index = totals_age_wave.wave, 
@@ -180,12 +539,13 @@ def get_wave_heatmap_data(data, variable):
     return heatmap_age_wave
 
 
+@profiled
 def get_age_heatmap_data(data, variable):
     """groups the covid dataset by age group and wave and creates a contingency
     table representing all age-wave combinations normalized to age totals
 
     Args:
-        data (pd.DataFrame): covid dataset returned by get_data()
+        data (pd.DataFrame or DenseStore): covid dataset returned by get_data()
         variable (string): observed variable
             'cases' covid cases
             'hospitalizations': hospitalizations 
@@ -195,11 +555,8 @@ def get_age_heatmap_data(data, variable):
     Returns:
         pandas.DataFrame: contingency table for the age group and wave variables
     """
-    # gby age and wave
-    totals_age_wave = data.groupby(['age', 'wave'], as_index = False).sum()
-    # drop NC age
-    mask = totals_age_wave.age != 'NC'
-    totals_age_wave = totals_age_wave[mask]
+    # gby age and wave, NC age dropped
+    totals_age_wave = get_totals_age_wave(data)
     # get cases dataframe
     heatmap_age_wave = pd.crosstab(
         index = totals_age_wave.age, 
@@ -211,62 +568,102 @@ def get_age_heatmap_data(data, variable):
     return heatmap_age_wave
 
 
+@profiled
 def get_hosp_ratio_data(data, pop):
     """
 
     Args:
-        data (pd.DataFrame): covid dataset returned by get_data()
-        pop (pd.Dataframe): population DataFrame
+        data (pd.DataFrame or DenseStore): covid dataset returned by get_data()
+        pop (pd.Dataframe): population dimension returned by get_population_dim()
 
     Returns:
         _type_: _description_
     """
     # get totals
-    totals_age_wave = data.groupby(['age', 'wave'], as_index = False).sum()
-    total_pop = pop.groupby('age').population.sum().drop('total')
-    # drop NC
-    mask = totals_age_wave.age != 'NC'
-    totals_age_wave = totals_age_wave[mask]
+    totals_age_wave = get_totals_age_wave(data)
     # calculate crosstabs
     cases = pd.crosstab(totals_age_wave.wave, totals_age_wave.age, totals_age_wave.cases, aggfunc=sum)
     hosp = pd.crosstab(totals_age_wave.wave, totals_age_wave.age, totals_age_wave.hospitalizations, aggfunc=sum)
     # get ratios
     hosp_cases = hosp/cases
-    hosp_total_pop = hosp/total_pop
+    hosp_total_pop = normalize_to_population(hosp, pop)
     return hosp_cases, hosp_total_pop
 
 
+@profiled
 def get_icu_ratio_data(data, pop):
-    totals_age_wave = data.groupby(['age', 'wave'], as_index = False).sum()
-    total_pop = pop.groupby('age').population.sum().drop('total')
-    mask = totals_age_wave.age != 'NC'
-    totals_age_wave = totals_age_wave[mask]
+    totals_age_wave = get_totals_age_wave(data)
     icu = pd.crosstab(totals_age_wave.wave, totals_age_wave.age, totals_age_wave.icu, aggfunc=sum)
     hosp = pd.crosstab(totals_age_wave.wave, totals_age_wave.age, totals_age_wave.hospitalizations, aggfunc=sum)
     icu_hosp = icu/hosp
-    icu_total_pop = icu/total_pop
+    icu_total_pop = normalize_to_population(icu, pop)
     return icu_hosp, icu_total_pop
 
 
+@profiled
 def get_deaths_ratio_data(data, pop):
-    totals_age_wave = data.groupby(['age', 'wave'], as_index = False).sum()
-    total_pop = pop.groupby('age').population.sum().drop('total')
-    mask = totals_age_wave.age != 'NC'
-    totals_age_wave = totals_age_wave[mask]
+    totals_age_wave = get_totals_age_wave(data)
     deaths = pd.crosstab(totals_age_wave.wave, totals_age_wave.age, totals_age_wave.deaths, aggfunc=sum)
     icu = pd.crosstab(totals_age_wave.wave, totals_age_wave.age, totals_age_wave.icu, aggfunc=sum)
     deaths_icu = deaths/icu
-    deaths_total_pop = deaths/total_pop
+    deaths_total_pop = normalize_to_population(deaths, pop)
     return deaths_icu, deaths_total_pop
 
 
+def get_bucket_starts(dates, bucket):
+    """position of the first date of every time bucket
+
+    Args:
+        dates (pd.DatetimeIndex): sorted dates
+        bucket (string): time bucket, a key of TIME_BUCKETS
+
+    Returns:
+        tuple(np.ndarray, np.ndarray): start positions and bucket labels
+    """
+    labels = np.asarray(TIME_BUCKETS[bucket](dates))
+    starts = np.flatnonzero(np.append(True, labels[1:] != labels[:-1]))
+    return starts, labels[starts]
+
+
+@profiled
+def get_age_time_heatmap_data(data, pop, variable, bucket='week'):
+    """incidence per 100k of every age group (NC excluded) and time bucket,
+    each bucket total being the difference of two rows of the cumulative sums
+    of the daily counts by age
+
+    Args:
+        data (pd.DataFrame or DenseStore): covid dataset returned by get_data()
+        pop (pd.DataFrame): population dimension returned by get_population_dim()
+        variable (string): observed variable
+        bucket (string, optional): time bucket, a key of TIME_BUCKETS
+
+    Returns:
+        pd.DataFrame: incidence per 100k with age groups as rows and buckets as columns
+    """
+    if isinstance(data, DenseStore):
+        dates, ages = data.axes['date'], data.axes['age']
+        prefix_sums = data.get_prefix_sums(('age', 'variable'))[..., data.axes['variable'].get_loc(variable)]
+    else:
+        daily = data.groupby(['date', 'age'])[variable].sum().unstack(fill_value=0)
+        dates, ages = pd.DatetimeIndex(daily.index), daily.columns.astype(str)
+        prefix_sums = np.zeros((daily.shape[0] + 1, daily.shape[1]), dtype=np.int64)
+        np.cumsum(daily.values, axis=0, out=prefix_sums[1:])
+    starts, labels = get_bucket_starts(dates, bucket)
+    totals = prefix_sums[np.append(starts[1:], dates.size)] - prefix_sums[starts]
+    heatmap = pd.DataFrame(totals.T, index=pd.Index(ages, name='age'), columns=pd.Index(labels, name=bucket))
+    heatmap = heatmap.drop('NC', errors='ignore')
+    age_pop = get_age_population(pop).reindex(heatmap.index)
+    return heatmap / age_pop.values[:, None] * 1e5
+
+
+@profiled
 def get_age_totalpop_norm_heatmap_data(data, data_pop, variable):
     """returns contingency table for age-wave combinations normalize to the
     total Spanish population
 
     Args:
-        data (pd.DataFrame): covid dataset returned by get_data()
-        data_pop (pd.DataFrame): dataset with information on the spanish population
+        data (pd.DataFrame or DenseStore): covid dataset returned by get_data()
+        data_pop (pd.DataFrame): population dimension returned by get_population_dim()
         variable (string): observed variable
             'cases' covid cases
             'hospitalizations': hospitalizations 
@@ -276,11 +673,8 @@ def get_age_totalpop_norm_heatmap_data(data, data_pop, variable):
     Returns:
         pandas.DataFrame: contingency table for the age group and wave variables
     """
-    # gby age and wave
-    totals_age_wave = data.groupby(['age', 'wave'], as_index = False).sum()
-    # drop NC age
-    mask = totals_age_wave.age != 'NC'
-    totals_age_wave = totals_age_wave[mask]
+    # gby age and wave, NC age dropped
+    totals_age_wave = get_totals_age_wave(data)
     # crosstab
     heatmap_wave_age = pd.crosstab(
         index = totals_age_wave.wave, 
@@ -289,12 +683,358 @@ def get_age_totalpop_norm_heatmap_data(data, data_pop, variable):
         aggfunc=sum,
         )
     # normalize to Spanish total pop by age group
-    total_pop = data_pop.groupby('age').population.sum().drop('total')
-    heatmap_wave_age = heatmap_wave_age/total_pop
+    heatmap_wave_age = normalize_to_population(heatmap_wave_age, data_pop)
     heatmap_wave_age = heatmap_wave_age.T
     return heatmap_wave_age
 
 
+# PIVOT FUNCTIONS
+#################
+
+def get_pivot_groups(store, dim, prov_dim):
+    """group code of every label of the store axis a pivot dimension rolls up
+
+    Args:
+        store (DenseStore): dense store of the covid dataset
+        dim (string): pivot dimension, a key of PIVOT_DIMS
+        prov_dim (pd.DataFrame): province dimension returned by get_province_dim()
+
+    Returns:
+        tuple(np.ndarray, pd.Index): group code of every axis label and group labels
+    """
+    axis = store.axes[PIVOT_DIMS[dim]]
+    if dim == 'wave':
+        codes, labels = pd.factorize(store.waves, sort=True)
+    elif dim == 'month':
+        codes, labels = pd.factorize(axis.strftime('%Y-%m'), sort=True)
+    elif dim == 'sex':
+        codes, labels = np.arange(axis.size), axis.map(lambda sex: SEX_LABELS.get(sex, sex))
+    elif dim == 'autonomousCommunity':
+        # join the provinces of the axis to the dimension on their integer key
+        keys = get_province_keys(axis, prov_dim)
+        communities = prov_dim.nombreCCAA.reindex(keys).fillna('NC')
+        codes, labels = pd.factorize(communities, sort=True)
+    else:
+        codes, labels = np.arange(axis.size), axis
+    return codes, pd.Index(labels, name=dim)
+
+
+def rollup(cube, axis, codes, n_groups):
+    """sums the labels of a cube axis into groups with a one-hot matrix product
+
+    Args:
+        cube (np.ndarray): integer array
+        axis (int): axis to roll up
+        codes (np.ndarray): group code of every label of the axis
+        n_groups (int): number of groups
+
+    Returns:
+        np.ndarray: array with n_groups labels on axis
+    """
+    onehot = np.zeros((codes.size, n_groups), dtype=cube.dtype)
+    onehot[np.arange(codes.size), codes] = 1
+    return np.moveaxis(np.moveaxis(cube, axis, -1) @ onehot, -1, axis)
+
+
+@profiled
+def get_pivot(store, rows, columns, value, prov_dim):
+    """pivots any two dimensions of the dense store, rolling up the cached
+    axis sums of the store instead of grouping the raw rows
+
+    Args:
+        store (DenseStore): dense store of the covid dataset
+        rows (string): pivot dimension of the rows, a key of PIVOT_DIMS
+        columns (string): pivot dimension of the columns, a key of PIVOT_DIMS
+        value (string): count or ratio, a key of PIVOT_VALUES
+        prov_dim (pd.DataFrame): province dimension returned by get_province_dim()
+
+    Returns:
+        pd.DataFrame: rows x columns table of the value, NaN for ratios over 0
+    """
+    if rows == columns:
+        raise ValueError('rows and columns must be different dimensions')
+    numerator, denominator = PIVOT_VALUES[value]
+    row_codes, row_labels = get_pivot_groups(store, rows, prov_dim)
+    col_codes, col_labels = get_pivot_groups(store, columns, prov_dim)
+    row_axis, col_axis = PIVOT_DIMS[rows], PIVOT_DIMS[columns]
+    keep = tuple(name for name in store.dims if name in (row_axis, col_axis, 'variable'))
+    cube = store.sum(keep)
+    if row_axis == col_axis:
+        # both dimensions roll up the same axis, group on the pair of codes
+        codes = row_codes * col_labels.size + col_codes
+        table = rollup(cube, 0, codes, row_labels.size * col_labels.size)
+        table = table.reshape(row_labels.size, col_labels.size, -1)
+    else:
+        table = rollup(cube, keep.index(row_axis), row_codes, row_labels.size)
+        table = rollup(table, keep.index(col_axis), col_codes, col_labels.size)
+        if keep.index(row_axis) > keep.index(col_axis):
+            table = table.swapaxes(0, 1)
+    variables = store.axes['variable']
+    values = table[..., variables.get_loc(numerator)].astype(np.float64)
+    if denominator is not None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = values / table[..., variables.get_loc(denominator)]
+        values[~np.isfinite(values)] = np.nan
+    return pd.DataFrame(values, index=row_labels, columns=col_labels)
+
+
+def get_pivot_population(store, rows, columns, pop_dim, prov_dim):
+    """population of every cell of a pivot, over the provinces and age bands
+    the cell covers, the other dimensions do not split the population
+
+    Args:
+        store (DenseStore): dense store of the covid dataset
+        rows (string): pivot dimension of the rows, a key of PIVOT_DIMS
+        columns (string): pivot dimension of the columns, a key of PIVOT_DIMS
+        pop_dim (pd.DataFrame): population dimension returned by get_population_dim()
+            with the age groups of the store
+        prov_dim (pd.DataFrame): province dimension returned by get_province_dim()
+
+    Returns:
+        pd.DataFrame: rows x columns table of the population
+    """
+    keys = get_province_keys(store.axes['province'], prov_dim)
+    ages = store.axes['age']
+    # provinces and ages covered by every group of both dimensions
+    groups = []
+    for dim in (rows, columns):
+        codes, labels = get_pivot_groups(store, dim, prov_dim)
+        axis = PIVOT_DIMS[dim]
+        provinces = [codes == k if axis == 'province' else np.ones(keys.size, bool) for k in range(labels.size)]
+        age_bands = [codes == k if axis == 'age' else np.ones(ages.size, bool) for k in range(labels.size)]
+        groups.append((labels, provinces, age_bands))
+    (row_labels, row_provinces, row_ages), (col_labels, col_provinces, col_ages) = groups
+    # one sum of the population dimension per distinct set of provinces
+    age_pops = {}
+    population = np.zeros((row_labels.size, col_labels.size))
+    for i in range(row_labels.size):
+        for j in range(col_labels.size):
+            province_keys = keys[row_provinces[i] & col_provinces[j] & (keys >= 0)]
+            key = province_keys.tobytes()
+            if key not in age_pops:
+                age_pops[key] = get_age_population(pop_dim, province_keys).reindex(ages, fill_value=0).values
+            population[i, j] = age_pops[key][row_ages[i] & col_ages[j]].sum()
+    return pd.DataFrame(population, index=row_labels, columns=col_labels)
+
+
+# FORECAST FUNCTIONS
+####################
+
+def fit_log_linear(log_series, horizon=FORECAST_DAYS, window=TREND_DAYS):
+    """fits an exponential growth trend to the last days of every series at
+    once, with a least squares line on the log counts
+
+    Args:
+        log_series (np.ndarray): log1p of the daily counts, one series per row
+        horizon (int, optional): days to forecast
+        window (int, optional): last days the trend is fit on
+
+    Returns:
+        np.ndarray: log forecast, one row per series
+    """
+    y = log_series[:, -window:]
+    t = np.arange(window, dtype=np.float64)
+    t_mean = t.mean()
+    y_mean = y.mean(axis=1, keepdims=True)
+    slope = ((t - t_mean) * (y - y_mean)).sum(axis=1, keepdims=True) / ((t - t_mean)**2).sum()
+    intercept = y_mean - slope * t_mean
+    return intercept + slope * np.arange(window, window + horizon)
+
+
+def fit_holt(log_series, horizon=FORECAST_DAYS, window=HOLT_DAYS, alphas=HOLT_ALPHAS, betas=HOLT_BETAS):
+    """fits Holt's linear trend model to the last days of every series,
+    running every pair of smoothing parameters at once and keeping the pair
+    with the lowest one-step squared error of each series
+
+    Args:
+        log_series (np.ndarray): log1p of the daily counts, one series per row
+        horizon (int, optional): days to forecast
+        window (int, optional): last days the model is fit on
+        alphas (np.ndarray, optional): level smoothing parameters to search
+        betas (np.ndarray, optional): trend smoothing parameters to search
+
+    Returns:
+        np.ndarray: log forecast, one row per series
+    """
+    y = log_series[:, -window:]
+    # (parameter pair, series) arrays
+    alpha, beta = (grid.reshape(-1, 1) for grid in np.meshgrid(alphas, betas, indexing='ij'))
+    level = np.broadcast_to(y[:, 0], (alpha.size, y.shape[0])).copy()
+    trend = np.broadcast_to(y[:, 1] - y[:, 0], level.shape).copy()
+    sse = np.zeros(level.shape)
+    for t in range(1, y.shape[1]):
+        error = y[:, t] - (level + trend)
+        sse += error**2
+        level = level + trend + alpha * error
+        trend = trend + alpha * beta * error
+    best = sse.argmin(axis=0)
+    series = np.arange(y.shape[0])
+    return level[best, series, None] + trend[best, series, None] * np.arange(1, horizon + 1)
+
+
+def get_backtest_spread(log_series, fit, horizon=FORECAST_DAYS, n_origins=BACKTEST_ORIGINS):
+    """half-width of the 95% prediction interval of every series and horizon,
+    from the errors of forecasts made at past origins one week apart
+
+    Args:
+        log_series (np.ndarray): log1p of the daily counts, one series per row
+        fit (callable): fit_log_linear() or fit_holt()
+        horizon (int, optional): days to forecast
+        n_origins (int, optional): past origins to forecast from
+
+    Returns:
+        np.ndarray: spread of the log forecast, one row per series
+    """
+    errors = []
+    for i in range(n_origins):
+        end = log_series.shape[1] - horizon - 7 * i
+        errors.append(log_series[:, end:end + horizon] - fit(log_series[:, :end], horizon))
+    return Z_95 * np.sqrt(np.mean(np.square(errors), axis=0))
+
+
+@profiled
+def get_forecasts(data, horizon=FORECAST_DAYS):
+    """forecasts the sma7 of every observed variable and age group with every
+    model, all series being fit at once, with prediction intervals from backtests
+
+    Args:
+        data (pd.DataFrame or DenseStore): covid dataset returned by get_data()
+        horizon (int, optional): days to forecast
+
+    Returns:
+        pd.DataFrame: model ('observed' for the last HISTORY_DAYS), variable,
+            age, date, value and the 95% interval (lower, upper) of the forecasts
+    """
+    age_series = get_sma7_gby_age_date(data)
+    # one row per (variable, age) series
+    wide = age_series.pivot(index='date', columns='age', values=list(DAILY_VARIABLES.values()))
+    log_series = np.log1p(wide.values.T.astype(np.float64))
+    variables = {column: variable for variable, column in DAILY_VARIABLES.items()}
+    series = pd.DataFrame({
+        'variable': wide.columns.get_level_values(0).map(variables),
+        'age': wide.columns.get_level_values(1),
+        })
+    observed = series.loc[series.index.repeat(HISTORY_DAYS)].reset_index(drop=True)
+    observed['model'] = 'observed'
+    observed['date'] = np.tile(wide.index[-HISTORY_DAYS:], len(series))
+    observed['value'] = wide.values.T[:, -HISTORY_DAYS:].ravel()
+    frames = [observed]
+    future = pd.date_range(wide.index[-1] + pd.Timedelta(days=1), periods=horizon, freq='D')
+    for model, fit in (('log-linear', fit_log_linear), ('holt', fit_holt)):
+        forecast = series.loc[series.index.repeat(horizon)].reset_index(drop=True)
+        forecast['model'] = model
+        forecast['date'] = np.tile(future, len(series))
+        values = fit(log_series, horizon)
+        spread = get_backtest_spread(log_series, fit, horizon)
+        for name, bound in (('value', values), ('lower', values - spread), ('upper', values + spread)):
+            forecast[name] = np.clip(np.expm1(bound), 0, None).ravel()
+        frames.append(forecast)
+    columns = ['model', 'variable', 'age', 'date', 'value', 'lower', 'upper']
+    return pd.concat(frames, ignore_index=True)[columns]
+
+
+# QUERY FUNCTIONS
+#################
+
+def get_date_slice(data, start_date, end_date):
+    """returns the rows between two dates (both included) of a date-sorted
+    covid dataset using a binary search on the date column
+
+    Args:
+        data (pd.DataFrame): covid dataset sorted by date
+        start_date (datetime-like): first date of the slice
+        end_date (datetime-like): last date of the slice
+
+    Returns:
+        pd.DataFrame: rows within the date range, as a view of data
+    """
+    dates = data.date.values
+    lower = np.searchsorted(dates, np.datetime64(start_date), side='left')
+    upper = np.searchsorted(dates, np.datetime64(end_date), side='right')
+    return data.iloc[lower:upper]
+
+
+@profiled
+def filter_covid_data(data, start_date, end_date, provinces=None, ages=None, sexes=None):
+    """filters a date-sorted covid dataset, the date range is resolved with
+    get_date_slice() so only the rows within it are scanned by the other filters
+
+    Args:
+        data (pd.DataFrame): covid dataset sorted by date
+        start_date (datetime-like): first date to keep
+        end_date (datetime-like): last date to keep
+        provinces (list, optional): province codes to keep, all if empty
+        ages (list, optional): age groups to keep, all if empty
+        sexes (list, optional): sexes to keep, all if empty
+
+    Returns:
+        pd.DataFrame: filtered dataset, still sorted by date
+    """
+    rows = get_date_slice(data, start_date, end_date)
+    mask = np.ones(len(rows), dtype=bool)
+    for column, values in (('province', provinces), ('age', ages), ('sex', sexes)):
+        if values:
+            mask &= rows[column].isin(values).values
+    if mask.all():
+        return rows
+    return rows[mask]
+
+
+def get_page(data, page, page_size):
+    """returns one page of a date-sorted dataset, newest rows first
+
+    Args:
+        data (pd.DataFrame): covid dataset sorted by date
+        page (int): page number, starting at 0
+        page_size (int): rows per page
+
+    Returns:
+        pd.DataFrame: rows of the page in descending date order
+    """
+    upper = max(len(data) - page * page_size, 0)
+    lower = max(upper - page_size, 0)
+    return data.iloc[lower:upper].iloc[::-1]
+
+
+@profiled
+def export_csv(data, chunksize=100_000):
+    """writes a dataset to csv bytes chunk by chunk so the intermediate text
+    never holds more than chunksize rows
+
+    Args:
+        data (pd.DataFrame): dataset to export
+        chunksize (int, optional): rows written per chunk
+
+    Returns:
+        bytes: csv file
+    """
+    buf = BytesIO()
+    for start in range(0, max(len(data), 1), chunksize):
+        chunk = data.iloc[start:start + chunksize]
+        buf.write(chunk.to_csv(sep=';', index=False, header=start == 0).encode())
+    return buf.getvalue()
+
+
+@profiled
+def export_parquet(data, chunksize=100_000):
+    """writes a dataset to parquet bytes, one row group per chunk
+
+    Args:
+        data (pd.DataFrame): dataset to export
+        chunksize (int, optional): rows per row group
+
+    Returns:
+        bytes: parquet file
+    """
+    buf = BytesIO()
+    schema = pa.Schema.from_pandas(data, preserve_index=False)
+    with pq.ParquetWriter(buf, schema) as writer:
+        for start in range(0, len(data), chunksize):
+            chunk = data.iloc[start:start + chunksize]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    return buf.getvalue()
+
+
 # PLOT FUNCTIONS
 ################
 
@@ -324,6 +1064,90 @@ def plot_lineplot(data, variable):
     return fig
 
 
+def plot_pivot_heatmap(pivot, value):
+    """plots a pivot table returned by get_pivot() as an interactive heatmap
+
+    Args:
+        pivot (pd.DataFrame): rows x columns table of the value
+        value (string): count or ratio, a key of PIVOT_VALUES
+
+    Returns:
+        plotly.graph_objects.Figure: interactive plotly visualization
+    """
+    fig = px.imshow(
+        pivot,
+        aspect='auto',
+        color_continuous_scale='Reds',
+        labels={'color': value},
+        height=max(400, 25 * len(pivot)),
+        title='{} by {} and {}'.format(value.capitalize(), pivot.index.name, pivot.columns.name),
+        )
+    fig.update_xaxes(type='category')
+    fig.update_yaxes(type='category')
+    return fig
+
+
+def plot_forecast(forecasts, variable, age):
+    """plots the observed sma7 of a series and the forecasts of every model
+    with their 95% prediction intervals
+
+    Args:
+        forecasts (pd.DataFrame): forecasts returned by get_forecasts()
+        variable (string): observed variable
+        age (string): age group or 'All Ages'
+
+    Returns:
+        plotly.graph_objects.Figure: interactive plotly visualization
+    """
+    rows = forecasts[(forecasts.variable == variable) & (forecasts.age == age)]
+    fig = go.Figure()
+    colors = iter(px.colors.qualitative.Plotly)
+    for model, model_rows in rows.groupby('model', sort=False):
+        color = next(colors)
+        if model != 'observed':
+            fig.add_trace(go.Scatter(
+                x=pd.concat([model_rows.date, model_rows.date[::-1]]),
+                y=pd.concat([model_rows.upper, model_rows.lower[::-1]]),
+                fill='toself',
+                fillcolor=color,
+                opacity=0.2,
+                line={'width': 0},
+                hoverinfo='skip',
+                showlegend=False,
+                ))
+        fig.add_trace(go.Scatter(x=model_rows.date, y=model_rows.value, name=model, line={'color': color}))
+    fig.update_layout(
+        template='simple_white',
+        height=500,
+        title='{}-day Forecast of the 7-day Simple Moving Average of {} ({})'.format(
+            FORECAST_DAYS, variable.capitalize(), age),
+        )
+    return fig
+
+
+def plot_age_time_heatmap(heatmap_data, variable, bucket):
+    """plots the incidence by age group and time bucket as an interactive heatmap
+
+    Args:
+        heatmap_data (pd.DataFrame): output of get_age_time_heatmap_data()
+        variable (string): observed variable
+        bucket (string): time bucket, a key of TIME_BUCKETS
+
+    Returns:
+        plotly.graph_objects.Figure: interactive plotly visualization
+    """
+    fig = px.imshow(
+        heatmap_data,
+        aspect='auto',
+        color_continuous_scale='Reds',
+        labels={'color': 'per 100k'},
+        height=400,
+        title='{} per 100k by Age Group and {}'.format(variable.capitalize(), bucket.capitalize()),
+        )
+    fig.update_xaxes(type='category')
+    return fig
+
+
 def plot_wave_heatmap(heatmap_data, barplot_data, variable):
     """plots a figure consisting of a heatmap and a barplot
 
@@ -603,4 +1427,187 @@ def plot_heatmap_ratios_deaths(heatmap_data1, heatmap_data2):
     # titles
     ax[0].set_title('Deaths by Wave as Percentage of ICU Admissions')
     ax[1].set_title('Deaths by Wave as Percentage of Age-Group Population')
-    return fig
\ No newline at end of file
+    return fig
+
+# ASSET FUNCTIONS
+#################
+
+@lru_cache(maxsize=8)
+def hash_file(path, size, mtime_ns):
+    """hashes a file in chunks; size and mtime_ns are part of the cache key so
+    the file is only re-read when it changes on disk
+
+    Args:
+        path (string): path of the file to hash
+        size (int): file size in bytes
+        mtime_ns (int): file modification time in nanoseconds
+
+    Returns:
+        string: short sha1 hex digest of the file content
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()[:12]
+
+
+def get_data_version(partitions_dir):
+    """returns the version of the covid dataset, used to key rendered assets,
+    from the manifest of its partitions and the waves
+
+    Args:
+        partitions_dir (pathlib.Path): directory of the DatePartitions
+
+    Returns:
+        string: data version
+    """
+    digests = []
+    for name in ('manifest.json', 'waves.csv'):
+        path = pathlib.Path(partitions_dir) / name
+        stat = path.stat()
+        digests.append(hash_file(str(path), stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha1(''.join(digests).encode()).hexdigest()[:12]
+
+
+@profiled
+def fig_to_png(fig):
+    """renders a matplotlib figure to png and closes it
+
+    Args:
+        fig (matplotlib.Figure): figure to render
+
+    Returns:
+        bytes: png image
+    """
+    buf = BytesIO()
+    fig.savefig(buf, format="png")
+    plt.close(fig)
+    return buf.getvalue()
+
+
+@profiled
+def compute_section_assets(data, pop, variable, age_series=None):
+    """computes every figure and data table shown in a variable section
+
+    Args:
+        data (pd.DataFrame or DenseStore): covid dataset with the wave variable
+        pop (pd.DataFrame): population dimension returned by get_population_dim()
+        variable (string): observed variable
+            'cases' covid cases
+            'hospitalizations': hospitalizations 
+            'icu': ICU admissions
+            'deaths': deaths
+        age_series (pd.DataFrame, optional): output of get_sma7_gby_age_date(),
+            computed when not given
+
+    Returns:
+        tuple(dict, dict): figures (plotly figure or png bytes) and tables by name
+    """
+    if age_series is None:
+        age_series = get_sma7_gby_age_date(data)
+    tables = {
+        'sma7_gby_age_date': age_series,
+        'wave_heatmap': get_wave_heatmap_data(data, variable),
+        'wave_totals': get_totals(data, 'wave').reset_index(),
+        'age_heatmap': get_age_heatmap_data(data, variable),
+        'age_totals': get_totals(data, 'age').drop('NC').reset_index(),
+    }
+    figures = {
+        'lineplot': plot_lineplot(age_series, DAILY_VARIABLES[variable]),
+        'wave_heatmap': fig_to_png(plot_wave_heatmap(
+            heatmap_data=tables['wave_heatmap'],
+            barplot_data=tables['wave_totals'],
+            variable=variable)),
+        'age_heatmap': fig_to_png(plot_heatmap_age(
+            heatmap_data=tables['age_heatmap'],
+            barplot_data=tables['age_totals'],
+            variable=variable)),
+    }
+    # calendar heatmaps, one per time bucket
+    for bucket in TIME_BUCKETS:
+        name = '{}_heatmap'.format(bucket)
+        tables[name] = get_age_time_heatmap_data(data, pop, variable, bucket)
+        figures[name] = plot_age_time_heatmap(tables[name], variable, bucket)
+    # last figure of each section compares the variable to the previous stage
+    if variable == 'cases':
+        tables['pop_heatmap'] = get_age_totalpop_norm_heatmap_data(data, pop, variable)
+        tables['pop_totals'] = get_age_population(pop).rename_axis('age').reset_index()
+        fig = plot_heatmap_pop(tables['pop_heatmap'], tables['pop_totals'])
+    else:
+        get_ratio_data, plot_ratios = RATIO_FUNCTIONS[variable]
+        tables['ratio_heatmap'], tables['pop_heatmap'] = get_ratio_data(data, pop)
+        fig = plot_ratios(tables['ratio_heatmap'], tables['pop_heatmap'])
+    figures['ratio_heatmap'] = fig_to_png(fig)
+    return figures, tables
+
+
+def save_section_assets(figures, tables, section_dir):
+    """writes the output of compute_section_assets() to a section directory
+
+    Args:
+        figures (dict): figures by name
+        tables (dict): tables by name
+        section_dir (pathlib.Path): directory for the section assets
+    """
+    section_dir = pathlib.Path(section_dir)
+    section_dir.mkdir(parents=True, exist_ok=True)
+    for name, fig in figures.items():
+        if isinstance(fig, bytes):
+            (section_dir / '{}.png'.format(name)).write_bytes(fig)
+        else:
+            (section_dir / '{}.json'.format(name)).write_text(fig.to_json())
+    for name, table in tables.items():
+        table.to_csv(section_dir / '{}.csv'.format(name), sep=';')
+    return None
+
+
+def has_section_assets(section_dir):
+    """checks that every figure of a section has been rendered
+
+    Args:
+        section_dir (pathlib.Path): directory for the section assets
+
+    Returns:
+        bool: True if load_section_assets() finds every figure
+    """
+    section_dir = pathlib.Path(section_dir)
+    return all((section_dir / filename).exists() for filename in SECTION_ASSETS.values())
+
+
+@profiled
+def load_section_assets(section_dir):
+    """loads the figures of a section rendered by save_section_assets()
+
+    Args:
+        section_dir (pathlib.Path): directory for the section assets
+
+    Returns:
+        dict: plotly figure or png path by name, None if the assets are missing
+    """
+    if not has_section_assets(section_dir):
+        return None
+    section_dir = pathlib.Path(section_dir)
+    paths = {name: section_dir / filename for name, filename in SECTION_ASSETS.items()}
+    figures = {
+        name: pio.from_json(path.read_text()) if path.suffix == '.json' else str(path)
+        for name, path in paths.items()
+        }
+    return figures
+
+
+# figure files rendered for every variable section
+SECTION_ASSETS = {
+    'lineplot': 'lineplot.json',
+    'wave_heatmap': 'wave_heatmap.png',
+    'age_heatmap': 'age_heatmap.png',
+    'ratio_heatmap': 'ratio_heatmap.png',
+    'week_heatmap': 'week_heatmap.json',
+    'month_heatmap': 'month_heatmap.json',
+}
+# variable -> (ratio data function, ratio plot function)
+RATIO_FUNCTIONS = {
+    'hospitalizations': (get_hosp_ratio_data, plot_heatmap_ratios_hosp),
+    'icu': (get_icu_ratio_data, plot_heatmap_ratios_icu),
+    'deaths': (get_deaths_ratio_data, plot_heatmap_ratios_deaths),
+}
@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import pathlib
+import random
+import time
+import uuid
+import numpy as np
+import pandas as pd
+import psutil
+from urllib.parse import urlencode
+from tornado.httpclient import HTTPRequest
+from tornado.websocket import websocket_connect
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from utils.app_classes import DataHandler
+from utils.app_funcs import DATA_SOURCE, SECTIONS, get_synthetic_data
+from utils.app_partitions import DatePartitions
+
+
+# largest message the app sends, figures included
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024
+
+
+async def rerun_section(ws, section):
+    """reruns the app script on a section of an open session and waits for
+    the run to finish
+
+    Args:
+        ws (tornado.websocket.WebSocketClientConnection): websocket of the session
+        section (string): sidebar section, passed as ?section=<name>
+
+    Returns:
+        tuple(float, bool): seconds until script_finished and whether the run
+            displayed no exception
+    """
+    msg = BackMsg()
+    msg.rerun_script.query_string = urlencode({'section': section})
+    start = time.perf_counter()
+    await ws.write_message(msg.SerializeToString(), binary=True)
+    # read deltas until the run ends
+    ok = True
+    while True:
+        payload = await ws.read_message()
+        if payload is None:
+            raise ConnectionError('app closed the websocket')
+        forward_msg = ForwardMsg()
+        forward_msg.ParseFromString(payload)
+        msg_type = forward_msg.WhichOneof('type')
+        if msg_type == 'delta' and forward_msg.delta.new_element.WhichOneof('type') == 'exception':
+            ok = False
+        if msg_type == 'script_finished':
+            break
+    return time.perf_counter() - start, ok
+
+
+async def run_session(url, n_pages, think_time, results):
+    """simulates one browser session: opens the app websocket and reruns the
+    script on random sections, timing each run until script_finished
+
+    Args:
+        url (string): websocket url of the app, ws://host:port/stream
+        n_pages (int): page views of the session
+        think_time (float): seconds between page views
+        results (list): (section, start time, latency, ok) tuples are appended here
+    """
+    # its own session cookie, so a multi-worker deployment pins it like a browser
+    request = HTTPRequest(url, headers={'Cookie': 'dashboard_session={}'.format(uuid.uuid4().hex)})
+    ws = await websocket_connect(request, max_message_size=MAX_MESSAGE_SIZE)
+    try:
+        for _ in range(n_pages):
+            section = random.choice(SECTIONS)
+            start = time.perf_counter()
+            latency, ok = await rerun_section(ws, section)
+            results.append((section, start, latency, ok))
+            await asyncio.sleep(think_time * random.uniform(0.5, 1.5))
+    finally:
+        ws.close()
+    return None
+
+
+async def sample_rss(pid, interval, samples, done):
+    """samples the resident set size of the app process until done is set
+
+    Args:
+        pid (int): process id of the app
+        interval (float): seconds between samples
+        samples (list): (time, rss bytes) tuples are appended here
+        done (asyncio.Event): stops the sampling
+    """
+    process = psutil.Process(pid)
+    while not done.is_set():
+        rss = process.memory_info().rss + sum(child.memory_info().rss for child in process.children(recursive=True))
+        samples.append((time.perf_counter(), rss))
+        try:
+            await asyncio.wait_for(done.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+    return None
+
+
+async def run_load_test(url, n_sessions, n_pages, think_time, ramp_up, pid=None, interval=1.0):
+    """drives n_sessions concurrent sessions against a running app
+
+    Args:
+        url (string): websocket url of the app
+        n_sessions (int): concurrent sessions
+        n_pages (int): page views per session
+        think_time (float): mean seconds between page views of a session
+        ramp_up (float): seconds over which the sessions are started
+        pid (int, optional): process id of the app to sample its RSS
+        interval (float, optional): seconds between RSS samples
+
+    Returns:
+        tuple(pd.DataFrame, pd.DataFrame, float): page views, RSS samples and wall time
+    """
+    results, samples = [], []
+    done = asyncio.Event()
+    sampler = asyncio.ensure_future(sample_rss(pid, interval, samples, done)) if pid else None
+
+    async def delayed_session(delay):
+        await asyncio.sleep(delay)
+        await run_session(url, n_pages, think_time, results)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        delayed_session(ramp_up * i / max(n_sessions, 1))
+        for i in range(n_sessions)
+        ])
+    wall_time = time.perf_counter() - start
+    done.set()
+    if sampler:
+        await sampler
+    page_views = pd.DataFrame(results, columns=['section', 'start', 'latency', 'ok'])
+    page_views['start'] -= start
+    rss = pd.DataFrame(samples, columns=['time', 'rss'])
+    rss['time'] -= start
+    return page_views, rss, wall_time
+
+
+def get_report(page_views, rss, wall_time):
+    """summarizes a load test
+
+    Args:
+        page_views (pd.DataFrame): page views returned by run_load_test()
+        rss (pd.DataFrame): RSS samples returned by run_load_test()
+        wall_time (float): seconds the test took
+
+    Returns:
+        string: latency percentiles by section, throughput and RSS
+    """
+    def percentiles(latency):
+        p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+        return pd.Series({'views': latency.size, 'p50': p50, 'p95': p95, 'p99': p99})
+
+    by_section = page_views.groupby('section').latency.apply(percentiles).unstack()
+    by_section.loc['All'] = percentiles(page_views.latency)
+    lines = [
+        'page latency (s)',
+        by_section.to_string(float_format='{:.3f}'.format),
+        '',
+        'throughput: {:.2f} pages/s over {:.1f} s, {} failed runs'.format(
+            len(page_views) / wall_time, wall_time, (~page_views.ok).sum()),
+        ]
+    if len(rss):
+        lines.append('server RSS: start {:.0f} MB, max {:.0f} MB, end {:.0f} MB'.format(
+            rss.rss.iloc[0] / 2**20, rss.rss.max() / 2**20, rss.rss.iloc[-1] / 2**20))
+    return '\n'.join(lines)
+
+
+
+
+if __name__ == '__main__':
+    # python -m utils.app_loadtest --sessions 20 --pages 10 --pid <streamlit pid>
+    parser = argparse.ArgumentParser(description='load test a running dashboard')
+    parser.add_argument('--url', default='ws://localhost:8501/stream')
+    parser.add_argument('--sessions', type=int, default=10, help='concurrent sessions')
+    parser.add_argument('--pages', type=int, default=10, help='page views per session')
+    parser.add_argument('--think-time', type=float, default=1.0, help='mean seconds between page views')
+    parser.add_argument('--ramp-up', type=float, default=5.0, help='seconds to start every session')
+    parser.add_argument('--pid', type=int, default=None, help='app process id, to sample its RSS')
+    parser.add_argument('--rss-csv', type=pathlib.Path, default=None, help='write the RSS samples here')
+    parser.add_argument('--synthetic-data', type=pathlib.Path, default=None,
+        help='write synthetic partitions to this data directory and exit')
+    parser.add_argument('--days', type=int, default=900, help='days of synthetic data')
+    args = parser.parse_args()
+    if args.synthetic_data:
+        # the synthetic months would be mixed with the downloaded ones
+        handler = DataHandler(DATA_SOURCE, args.synthetic_data)
+        partitions = DatePartitions(handler.partitions_dir)
+        if partitions.manifest['partitions']:
+            parser.error('{} already holds partitions: remove or move that directory first'.format(
+                handler.partitions_dir))
+        prov = pd.read_csv(args.synthetic_data / 'provincias.csv', keep_default_na=False)
+        partitions.write(get_synthetic_data(prov, args.days))
+        handler.compute_wave_variable()
+        print('synthetic data written to {}'.format(handler.partitions_dir))
+    else:
+        page_views, rss, wall_time = asyncio.run(run_load_test(
+            args.url, args.sessions, args.pages, args.think_time, args.ramp_up, args.pid))
+        print(get_report(page_views, rss, wall_time))
+        if args.rss_csv:
+            rss.to_csv(args.rss_csv, index=False)
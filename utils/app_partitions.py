@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import pathlib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# days before the last date the ministry may still revise
+REVISION_DAYS = 28
+# partition columns, rows are sorted on the key columns so equal content
+# always gets the same checksum
+KEY_COLUMNS = ['date', 'province', 'sex', 'age']
+COUNT_COLUMNS = ['cases', 'hospitalizations', 'icu', 'deaths']
+
+
+
+class DatePartitions():
+    """Covid dataset split into monthly parquet files with a manifest of the
+    row count and checksum of every partition, so refreshes only rewrite the
+    months that changed and loads only read the months a date range touches.
+    The wave of every date is kept next to them in waves.csv
+    """
+
+    def __init__(self, partitions_dir):
+        """opens a partitioned dataset, empty if the manifest does not exist
+
+        Args:
+            partitions_dir (pathlib.Path): directory of the partitions
+        """
+        self.partitions_dir = pathlib.Path(partitions_dir)
+        self.manifest_path = self.partitions_dir / 'manifest.json'
+        self.waves_path = self.partitions_dir / 'waves.csv'
+        if self.manifest_path.exists():
+            self.manifest = json.loads(self.manifest_path.read_text())
+        else:
+            self.manifest = {'partitions': {}}
+        return None
+
+
+    @staticmethod
+    def get_checksum(part):
+        """checksum of the content of a partition, independent of the file encoding
+
+        Args:
+            part (pd.DataFrame): normalized partition
+
+        Returns:
+            string: sha1 hex digest
+        """
+        hashes = pd.util.hash_pandas_object(part, index=False).values
+        return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+
+    @staticmethod
+    def normalize(data):
+        """casts the partition columns to fixed dtypes and sorts the rows on the keys
+
+        Args:
+            data (pd.DataFrame): covid dataset returned by get_data() or read_covid_data()
+
+        Returns:
+            pd.DataFrame: normalized dataset
+        """
+        data = data[KEY_COLUMNS + COUNT_COLUMNS].astype(
+            {'province': str, 'sex': str, 'age': str, **{column: 'int64' for column in COUNT_COLUMNS}})
+        data['date'] = pd.to_datetime(data.date)
+        return data.sort_values(KEY_COLUMNS, kind='mergesort', ignore_index=True)
+
+
+    def write(self, data, revision_days=REVISION_DAYS):
+        """writes a refreshed dataset, only checking the months within the
+        revision window and the months missing from the manifest, and only
+        rewriting those whose checksum changed
+
+        Args:
+            data (pd.DataFrame): full covid dataset returned by get_data()
+            revision_days (int, optional): days before the last date that may
+                have been revised since the previous refresh
+
+        Returns:
+            list: months rewritten
+        """
+        self.partitions_dir.mkdir(parents=True, exist_ok=True)
+        partitions = self.manifest['partitions']
+        months = data.date.values.astype('datetime64[M]')
+        first_revised = (data.date.max() - pd.Timedelta(days=revision_days)).to_datetime64().astype('datetime64[M]')
+        known = np.array(list(partitions), dtype='datetime64[M]')
+        mask = (months >= first_revised) | ~np.isin(months, known)
+        written = []
+        for month, part in data[mask].groupby(months[mask], sort=True):
+            month = pd.Timestamp(month).strftime('%Y-%m')
+            part = self.normalize(part)
+            checksum = self.get_checksum(part)
+            if partitions.get(month, {}).get('sha1') == checksum:
+                continue
+            path = self.partitions_dir / '{}.parquet'.format(month)
+            tmp_path = self.partitions_dir / '{}.tmp.parquet'.format(month)
+            pq.write_table(pa.Table.from_pandas(part, preserve_index=False), tmp_path)
+            os.replace(tmp_path, path)
+            partitions[month] = {
+                'file': path.name,
+                'rows': len(part),
+                'sha1': checksum,
+                'first_date': part.date.iloc[0].strftime('%Y-%m-%d'),
+                'last_date': part.date.iloc[-1].strftime('%Y-%m-%d'),
+                }
+            written.append(month)
+        # the manifest is swapped in last, readers see the old or the new months
+        self.manifest['partitions'] = dict(sorted(partitions.items()))
+        tmp_path = self.partitions_dir / 'manifest.tmp.json'
+        tmp_path.write_text(json.dumps(self.manifest, indent=1))
+        os.replace(tmp_path, self.manifest_path)
+        return written
+
+
+    def get_months(self, start_date=None, end_date=None):
+        """months of the partitions overlapping a date range
+
+        Args:
+            start_date (datetime.date, optional): first date, unbounded if None
+            end_date (datetime.date, optional): last date, unbounded if None
+
+        Returns:
+            list: months in date order
+        """
+        start = pd.Timestamp(start_date).strftime('%Y-%m-%d') if start_date is not None else ''
+        end = pd.Timestamp(end_date).strftime('%Y-%m-%d') if end_date is not None else '9999'
+        return [
+            month for month, entry in self.manifest['partitions'].items()
+            if entry['last_date'] >= start and entry['first_date'] <= end
+            ]
+
+
+    def read(self, start_date=None, end_date=None, columns=None):
+        """reads the partitions a date range touches
+
+        Args:
+            start_date (datetime.date, optional): first date, unbounded if None
+            end_date (datetime.date, optional): last date, unbounded if None
+            columns (list, optional): columns to read, the date included, all if None
+
+        Returns:
+            pd.DataFrame: date-sorted covid dataset within the range, with
+                categorical provinces
+        """
+        parts = [
+            pq.read_table(self.partitions_dir / self.manifest['partitions'][month]['file'], columns=columns).to_pandas()
+            for month in self.get_months(start_date, end_date)
+            ]
+        if not parts:
+            return self.normalize(pd.DataFrame(columns=KEY_COLUMNS + COUNT_COLUMNS))[columns or slice(None)]
+        data = pd.concat(parts, ignore_index=True)
+        # trim the first and last partitions with a binary search on the sorted dates
+        dates = data.date.values
+        start = 0 if start_date is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(start_date)), 'left')
+        end = dates.size if end_date is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(end_date)), 'right')
+        data = data.iloc[start:end].reset_index(drop=True)
+        if 'province' in data.columns:
+            data['province'] = data.province.astype('category')
+        return data
+
+
+    def write_waves(self, waves):
+        """writes the wave of every date, computed on the whole dataset
+
+        Args:
+            waves (pd.Series): wave indexed by date
+        """
+        tmp_path = self.partitions_dir / 'waves.tmp.csv'
+        waves.rename_axis('date').rename('wave').to_csv(tmp_path, sep=';')
+        os.replace(tmp_path, self.waves_path)
+        return None
+
+
+    def read_waves(self):
+        """reads the waves written by write_waves()
+
+        Returns:
+            pd.Series: wave indexed by date
+        """
+        return pd.read_csv(self.waves_path, sep=';', parse_dates=['date'], index_col='date').wave
+
+
+    def verify(self):
+        """checks the row count and checksum of every partition against the manifest
+
+        Returns:
+            list: months whose file is missing or does not match the manifest
+        """
+        corrupted = []
+        for month, entry in self.manifest['partitions'].items():
+            try:
+                part = pq.read_table(self.partitions_dir / entry['file']).to_pandas()
+            except (FileNotFoundError, OSError):
+                corrupted.append(month)
+                continue
+            if len(part) != entry['rows'] or self.get_checksum(part) != entry['sha1']:
+                corrupted.append(month)
+        return corrupted
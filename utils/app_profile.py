@@ -0,0 +1,171 @@
+import functools
+import os
+import threading
+import time
+import tracemalloc
+import pandas as pd
+import psutil
+from collections import deque
+from contextlib import contextmanager
+from pympler import muppy, summary
+
+
+# opt-in: DASHBOARD_PROFILE_MEMORY=1 streamlit run app.py
+PROFILE_MEMORY = os.environ.get('DASHBOARD_PROFILE_MEMORY') == '1'
+# snapshots are only compared by source line, one frame is enough
+TRACE_FRAMES = 1
+TOP_ALLOCATORS = 15
+# reruns kept in the history
+MAX_RERUNS = 1000
+
+lock = threading.Lock()
+# stage -> running totals of the calls, see profile_stage()
+stage_stats = {}
+# one dict per rerun, see end_rerun()
+reruns = deque(maxlen=MAX_RERUNS)
+# the last two snapshots taken by take_snapshot()
+snapshots = deque(maxlen=2)
+
+
+def start_profiling():
+    """starts tracemalloc when the memory profiling mode is enabled
+
+    Returns:
+        bool: whether the profiling mode is enabled
+    """
+    if PROFILE_MEMORY and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACE_FRAMES)
+    return PROFILE_MEMORY
+
+
+def take_snapshot():
+    """takes a tracemalloc snapshot and compares it with the previous one,
+    slow with large datasets as every traced block is grouped in python
+
+    Returns:
+        pd.DataFrame: file:line, size and count growth of the top allocators
+            since the previous snapshot, None for the first snapshot
+    """
+    snapshot = tracemalloc.take_snapshot()
+    with lock:
+        snapshots.append(snapshot)
+        if len(snapshots) < 2:
+            return None
+        previous = snapshots[0]
+    stats = snapshot.compare_to(previous, 'lineno')[:TOP_ALLOCATORS]
+    return pd.DataFrame(
+        [(str(stat.traceback[0]), stat.size_diff, stat.size, stat.count_diff) for stat in stats],
+        columns=['allocator', 'size_diff', 'size', 'count_diff'],
+        )
+
+
+@contextmanager
+def profile_stage(name):
+    """records the traced memory allocated and still alive after a block of
+    code, a no-op unless tracemalloc is tracing
+
+    Args:
+        name (string): stage name
+    """
+    if not tracemalloc.is_tracing():
+        yield
+        return
+    before, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        after, _ = tracemalloc.get_traced_memory()
+        with lock:
+            stats = stage_stats.setdefault(name, {'calls': 0, 'last': 0, 'retained': 0, 'seconds': 0.0})
+            stats['calls'] += 1
+            # traced bytes allocated and still alive after the stage
+            stats['last'] = after - before
+            stats['retained'] += after - before
+            stats['seconds'] += elapsed
+
+
+def profiled(func):
+    """decorator wrapping a function in profile_stage() under its own name"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not tracemalloc.is_tracing():
+            return func(*args, **kwargs)
+        with profile_stage(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def end_rerun(session_id, section):
+    """records the process memory at the end of a script run and the growth
+    since the previous run of any session
+
+    Args:
+        session_id (string): streamlit session id
+        section (string): section shown by the run
+    """
+    if not tracemalloc.is_tracing():
+        return None
+    current, peak = tracemalloc.get_traced_memory()
+    with lock:
+        growth = current - reruns[-1]['traced'] if reruns else 0
+        reruns.append({
+            'rerun': reruns[-1]['rerun'] + 1 if reruns else 1,
+            'session': session_id,
+            'section': section,
+            'traced': current,
+            'traced_peak': peak,
+            'growth': growth,
+            'rss': psutil.Process().memory_info().rss,
+            })
+    return None
+
+
+def get_stage_report():
+    """summarizes the stages recorded by profile_stage()
+
+    Returns:
+        pd.DataFrame: calls, retained bytes and time of every stage
+    """
+    with lock:
+        rows = [
+            (name, stats['calls'], stats['last'], stats['retained'], stats['seconds'] / stats['calls'])
+            for name, stats in stage_stats.items()
+            ]
+    return pd.DataFrame(
+        rows,
+        columns=['stage', 'calls', 'last_retained', 'total_retained', 'mean_seconds'],
+        ).sort_values('total_retained', ascending=False)
+
+
+def get_session_report():
+    """aggregates the rerun growth by session
+
+    Returns:
+        pd.DataFrame: reruns and traced memory growth of every session
+    """
+    with lock:
+        history = pd.DataFrame(reruns)
+    if history.empty:
+        return history
+    return history.groupby('session').agg(
+        reruns = ('rerun', 'size'),
+        growth = ('growth', 'sum'),
+        last_section = ('section', 'last'),
+        ).sort_values('growth', ascending=False)
+
+
+def get_object_summary(limit=20):
+    """summarizes the live python objects by type with Pympler, slow as it
+    walks every object
+
+    Args:
+        limit (int, optional): number of types to return
+
+    Returns:
+        pd.DataFrame: count and total size of the largest object types
+    """
+    rows = summary.summarize(muppy.get_objects())
+    rows = sorted(rows, key=lambda row: row[2], reverse=True)[:limit]
+    return pd.DataFrame(rows, columns=['type', 'count', 'size'])
@@ -0,0 +1,176 @@
+import copy
+import json
+import os
+import pathlib
+import numpy as np
+import pandas as pd
+
+
+
+class DenseStore():
+    """Dense (province x sex x age x date x variable) array of daily counts,
+    memory-mapped read-only so every process shares it through the page cache
+    """
+
+    def __init__(self, store_dir):
+        """opens a store written by DenseStore.build()
+
+        Args:
+            store_dir (pathlib.Path): directory of the store
+        """
+        self.store_dir = pathlib.Path(store_dir)
+        meta = json.loads((self.store_dir / 'axes.json').read_text())
+        self.axes = {name: pd.Index(labels, name=name) for name, labels in meta['axes'].items()}
+        self.axes['date'] = pd.DatetimeIndex(self.axes['date'], name='date')
+        self.dims = list(self.axes)
+        # wave label of every date
+        self.waves = np.array(meta['wave'])
+        self.counts = np.load(self.store_dir / 'counts.npy', mmap_mode='r')
+        self.cache = {}
+        # set on the views returned by slice_dates()
+        self.parent, self.dates = None, slice(None)
+        return None
+
+
+    @classmethod
+    def build(cls, data, store_dir, variables):
+        """writes a covid dataset to a store, dates missing from the dataset
+        are stored as zero counts
+
+        Args:
+            data (pd.DataFrame): covid dataset with the wave variable
+            store_dir (pathlib.Path): directory of the store
+            variables (list): observed variables to store
+
+        Returns:
+            DenseStore: the opened store
+        """
+        store_dir = pathlib.Path(store_dir)
+        store_dir.mkdir(parents=True, exist_ok=True)
+        # label index and row codes for every axis
+        axes, codes = {}, []
+        for name in ('province', 'sex', 'age'):
+            values = data[name].astype(str)
+            labels = pd.Index(sorted(values.unique()))
+            axes[name] = labels.tolist()
+            codes.append(labels.get_indexer(values))
+        dates = pd.date_range(data.date.min(), data.date.max(), freq='D')
+        axes['date'] = dates.strftime('%Y-%m-%d').tolist()
+        codes.append(dates.get_indexer(data.date))
+        axes['variable'] = list(variables)
+        shape = tuple(len(labels) for labels in axes.values())
+        # fill the array one variable at a time with a bincount on the flat cell index
+        cells = np.ravel_multi_index(codes, shape[:-1])
+        tmp_path = store_dir / 'counts.tmp.npy'
+        counts = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.int32, shape=shape)
+        flat = counts.reshape(-1, shape[-1])
+        for i, variable in enumerate(variables):
+            weights = data[variable].to_numpy(dtype=np.float64, na_value=0)
+            flat[:, i] = np.bincount(cells, weights=weights, minlength=flat.shape[0])
+        counts.flush()
+        del counts, flat
+        # wave label of every date, carried forward over missing dates
+        if 'wave' in data.columns:
+            waves = pd.Series(data.wave.astype(int).values).groupby(codes[3]).max()
+            waves = waves.reindex(range(dates.size)).ffill().astype(int).tolist()
+        else:
+            waves = [1] * dates.size
+        # swap in the new files
+        os.replace(tmp_path, store_dir / 'counts.npy')
+        tmp_path = store_dir / 'axes.tmp.json'
+        tmp_path.write_text(json.dumps({'axes': axes, 'wave': waves}))
+        os.replace(tmp_path, store_dir / 'axes.json')
+        return cls(store_dir)
+
+
+    def sum(self, keep):
+        """sums the counts over every axis not in keep, results are cached as
+        the store is read-only. Views answer from the sums of their parent:
+        a slice of them when the date axis is kept, a difference of prefix
+        sums when it is summed over
+
+        Args:
+            keep (tuple): names of the axes to keep, in store order
+
+        Returns:
+            np.ndarray: int64 array with the kept axes
+        """
+        keep = tuple(keep)
+        if keep not in self.cache:
+            if self.parent is None:
+                axis = tuple(i for i, name in enumerate(self.dims) if name not in keep)
+                self.cache[keep] = self.counts.sum(axis=axis, dtype=np.int64)
+            elif 'date' in keep:
+                index = (slice(None),) * keep.index('date') + (self.dates,)
+                self.cache[keep] = self.parent.sum(keep)[index]
+            else:
+                prefix_sums = self.parent.get_prefix_sums(keep)
+                self.cache[keep] = prefix_sums[self.dates.stop] - prefix_sums[self.dates.start]
+        return self.cache[keep]
+
+
+    def get_prefix_sums(self, keep):
+        """cumulative sums over the dates of the counts summed over every axis
+        not in keep, so the total of any date range is a difference of two rows
+
+        Args:
+            keep (tuple): names of the axes to keep besides the date, in store order
+
+        Returns:
+            np.ndarray: int64 array with the dates + 1 on the first axis, then the kept axes
+        """
+        key = ('prefix_sums',) + tuple(keep)
+        if key not in self.cache:
+            with_date = tuple(name for name in self.dims if name in keep or name == 'date')
+            by_date = np.moveaxis(self.sum(with_date), with_date.index('date'), 0)
+            prefix_sums = np.zeros((by_date.shape[0] + 1,) + by_date.shape[1:], dtype=np.int64)
+            np.cumsum(by_date, axis=0, out=prefix_sums[1:])
+            self.cache[key] = prefix_sums
+        return self.cache[key]
+
+
+    def slice_dates(self, start_date, end_date):
+        """restricts the store to a date range without copying the counts,
+        the processing functions take the view like the full store
+
+        Args:
+            start_date (datetime-like): first date of the range
+            end_date (datetime-like): last date of the range
+
+        Returns:
+            DenseStore: view of the dates within the range
+        """
+        dates = self.axes['date']
+        start = dates.searchsorted(pd.Timestamp(start_date), side='left')
+        stop = dates.searchsorted(pd.Timestamp(end_date), side='right')
+        view = copy.copy(self)
+        view.parent, view.dates, view.cache = self, slice(start, stop), {}
+        view.axes = dict(self.axes, date=dates[start:stop])
+        view.waves = self.waves[start:stop]
+        view.counts = self.counts[:, :, :, start:stop]
+        return view
+
+
+    def with_waves(self, waves):
+        """relabels the waves of the store, the view shares the cached sums as
+        they do not depend on the waves
+
+        Args:
+            waves (np.ndarray): wave label of every date
+
+        Returns:
+            DenseStore: view with the new waves
+        """
+        view = copy.copy(self)
+        view.waves = np.asarray(waves)
+        return view
+
+
+    def wave_starts(self):
+        """returns the date index where each wave starts and the wave labels
+
+        Returns:
+            tuple(np.ndarray, np.ndarray): start positions and wave labels
+        """
+        starts = np.flatnonzero(np.diff(self.waves, prepend=self.waves[0] - 1))
+        return starts, self.waves[starts]
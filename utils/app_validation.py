@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+
+
+# source column -> dataset column
+SOURCE_COLUMNS = {
+    'provincia_iso': 'province',
+    'sexo': 'sex',
+    'grupo_edad': 'age',
+    'fecha': 'date',
+    'num_casos': 'cases',
+    'num_hosp': 'hospitalizations',
+    'num_uci': 'icu',
+    'num_def': 'deaths',
+}
+# source age group -> dataset age group
+AGE_LABELS = {
+    '0-9': '0s',
+    '10-19': '10s',
+    '20-29': '20s',
+    '30-39': '30s',
+    '40-49': '40s',
+    '50-59': '50s',
+    '60-69': '60s',
+    '70-79': '70s',
+    '80+': '80+',
+    'NC': 'NC',
+}
+SEXES = ['H', 'M', 'NC']
+KEY_COLUMNS = ['province', 'sex', 'age', 'date']
+COUNT_COLUMNS = ['cases', 'hospitalizations', 'icu', 'deaths']
+# no covid data before this date
+FIRST_DATE = pd.Timestamp('2020-01-01')
+# rows parsed and checked at once
+CHUNK_ROWS = 500_000
+
+
+
+class FeedValidator():
+    """Checks the chunks of the ministry feed as they are read and formats
+    them to the covid dataset columns. Only the keys of the last date are
+    kept between chunks, so memory is bounded by the chunk size
+    """
+
+    def __init__(self, provinces=None):
+        """
+        Args:
+            provinces (list, optional): valid province codes, not checked if None
+        """
+        self.provinces = provinces
+        # check -> [failed rows, line of the first failure]
+        self.errors = {}
+        self.rows = 0
+        self.last_date = None
+        self.last_keys = pd.DataFrame(columns=KEY_COLUMNS)
+        return None
+
+
+    def add_error(self, check, failed):
+        """records the rows of a chunk failing a check
+
+        Args:
+            check (string): description of the check
+            failed (np.ndarray): boolean mask of the failed rows
+        """
+        failed = np.asarray(failed)
+        n_failed = int(failed.sum())
+        if n_failed:
+            # data lines start at 2 after the header
+            line = self.rows + int(failed.argmax()) + 2
+            self.errors.setdefault(check, [0, line])[0] += n_failed
+        return None
+
+
+    def validate(self, chunk):
+        """checks a chunk of the feed and formats it
+
+        Args:
+            chunk (pd.DataFrame): consecutive rows of the feed, counts as floats
+                and every other column as str
+
+        Returns:
+            pd.DataFrame: chunk with the dataset columns, categorical keys,
+                parsed dates and integer counts
+        """
+        missing = [column for column in SOURCE_COLUMNS if column not in chunk.columns]
+        if missing:
+            raise ValueError('missing the columns {}'.format(missing))
+        chunk = chunk[list(SOURCE_COLUMNS)].rename(columns=SOURCE_COLUMNS)
+        # dates, increasing across the whole feed
+        dates = pd.to_datetime(chunk.date, format='%Y-%m-%d', errors='coerce')
+        self.add_error('unparseable date', dates.isna())
+        today = pd.Timestamp.today().normalize()
+        self.add_error('date out of range', (dates < FIRST_DATE) | (dates > today + pd.Timedelta(days=1)))
+        values = dates.values
+        previous = np.concatenate([[self.last_date if self.last_date is not None else values[0]], values[:-1]])
+        self.add_error('date before the previous row', values < previous)
+        # categorical domains, the age groups are mapped by label
+        age = chunk.age.map(AGE_LABELS)
+        self.add_error('unknown age group', age.isna())
+        self.add_error('unknown sex', ~chunk.sex.isin(SEXES))
+        # the feed may pad the province codes
+        province = chunk.province.str.strip()
+        if self.provinces is not None:
+            self.add_error('unknown province', ~province.isin(self.provinces))
+        # non-negative integer counts
+        counts = {}
+        for column in COUNT_COLUMNS:
+            values = chunk[column].values
+            self.add_error('non-integer {}'.format(column), np.isnan(values) | (values % 1 != 0))
+            self.add_error('negative {}'.format(column), values < 0)
+            counts[column] = np.nan_to_num(values).astype(np.int64)
+        data = pd.DataFrame({
+            'province': province.values,
+            'sex': pd.Categorical(chunk.sex, categories=SEXES),
+            'age': pd.Categorical(age, categories=list(dict.fromkeys(AGE_LABELS.values()))),
+            'date': dates.values,
+            **counts,
+            })
+        # duplicated keys, rows of the same date can straddle two chunks
+        keys = pd.concat([self.last_keys, data[KEY_COLUMNS]], ignore_index=True)
+        self.add_error('duplicated key', keys.duplicated().values[len(self.last_keys):])
+        if dates.notna().any():
+            self.last_date = dates.max().to_datetime64()
+            self.last_keys = data.loc[dates.values == self.last_date, KEY_COLUMNS]
+        self.rows += len(chunk)
+        return data
+
+
+    def check(self):
+        """raises if any check failed
+
+        Raises:
+            ValueError: description of the failed checks
+        """
+        if self.errors:
+            raise ValueError('invalid covid feed: {}'.format('; '.join(
+                '{} ({} rows, first at line {})'.format(check, n_failed, line)
+                for check, (n_failed, line) in self.errors.items()
+                )))
+        return None
+
+
+
+
+def read_feed(source, provinces=None, chunksize=CHUNK_ROWS):
+    """reads the ministry feed in chunks, checking every chunk before it is kept
+
+    Args:
+        source (string): url or path of the feed csv
+        provinces (list, optional): valid province codes, not checked if None
+        chunksize (int, optional): rows parsed and checked at once
+
+    Raises:
+        ValueError: the feed failed a check, nothing is returned
+
+    Returns:
+        pd.DataFrame: covid dataset sorted by date
+    """
+    validator = FeedValidator(provinces)
+    # counts parsed by the csv reader, everything else kept as strings as 'NA' is the Navarra code
+    counts = [column for column, name in SOURCE_COLUMNS.items() if name in COUNT_COLUMNS]
+    reader = pd.read_csv(
+        source,
+        dtype={column: np.float64 if column in counts else str for column in SOURCE_COLUMNS},
+        keep_default_na=False,
+        na_values={column: [''] for column in counts},
+        chunksize=chunksize,
+        )
+    try:
+        chunks = [validator.validate(chunk) for chunk in reader]
+    except ValueError as e:
+        # unparseable counts or missing columns
+        raise ValueError('invalid covid feed: {}'.format(e)) from e
+    validator.check()
+    if not chunks:
+        raise ValueError('invalid covid feed: no rows')
+    data = pd.concat(chunks, ignore_index=True)
+    data['province'] = data.province.astype('category')
+    return data
@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tornado.httpclient import HTTPClientError
+from tornado.websocket import websocket_connect
+from utils.app_funcs import SECTIONS
+from utils.app_loadtest import MAX_MESSAGE_SIZE, rerun_section
+
+
+logger = logging.getLogger(__name__)
+# seconds a worker has to start accepting sessions
+CONNECT_TIMEOUT = 300.0
+lock = threading.Lock()
+# warm-up state served on /ready
+status = {'ready': False, 'error': None, 'timings': {}}
+
+
+async def connect(url, timeout=CONNECT_TIMEOUT):
+    """opens a session on an app, retrying while the app is starting
+
+    Args:
+        url (string): websocket url of the app, ws://host:port/stream
+        timeout (float, optional): seconds to keep retrying
+
+    Returns:
+        tornado.websocket.WebSocketClientConnection: websocket of the session
+    """
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            return await websocket_connect(url, max_message_size=MAX_MESSAGE_SIZE)
+        except (OSError, HTTPClientError):
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.5)
+
+
+async def warm_up_worker(url, sections=SECTIONS):
+    """runs the app script once on every section so the process loads the
+    data version, the store and the forecasts, and the figures missing from
+    the assets are rendered to the shared cache, before any user arrives
+
+    Args:
+        url (string): websocket url of the app, ws://host:port/stream
+        sections (list, optional): sections to visit
+
+    Raises:
+        RuntimeError: a section displayed an exception
+
+    Returns:
+        dict: seconds of the first run of every section
+    """
+    start = time.perf_counter()
+    ws = await connect(url)
+    timings = {}
+    try:
+        for section in sections:
+            latency, ok = await rerun_section(ws, section)
+            if not ok:
+                raise RuntimeError('{} raised an exception on {}'.format(section, url))
+            timings[section] = round(latency, 3)
+            logger.info('%s: %s warmed up in %.2f s', url, section, latency)
+    finally:
+        ws.close()
+    logger.info('%s: warmed up in %.2f s', url, time.perf_counter() - start)
+    return timings
+
+
+async def warm_up(urls, sections=SECTIONS):
+    """warms up every worker concurrently
+
+    Args:
+        urls (list): websocket urls of the workers
+        sections (list, optional): sections to visit
+
+    Returns:
+        dict: timings of every worker returned by warm_up_worker()
+    """
+    timings = await asyncio.gather(*[warm_up_worker(url, sections) for url in urls])
+    return dict(zip(urls, timings))
+
+
+
+class ReadinessHandler(BaseHTTPRequestHandler):
+    """readiness probe: /ready answers 503 until every worker is warm"""
+
+
+    def do_GET(self):
+        if self.path != '/ready':
+            self.send_response(404)
+            self.end_headers()
+            return None
+        with lock:
+            body = json.dumps(status).encode()
+            code = 200 if status['ready'] else 503
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+        return None
+
+
+    def log_message(self, format, *args):
+        # probes hit every few seconds
+        return None
+
+
+
+
+if __name__ == '__main__':
+    # python -m utils.app_warmup --url ws://127.0.0.1:8501/stream [--url ...] [--port 8502]
+    parser = argparse.ArgumentParser(description='warm up the app workers and serve a readiness probe')
+    parser.add_argument('--url', action='append', required=True, help='websocket url of a worker')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8502, help='port of the /ready probe')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    server = ThreadingHTTPServer((args.host, args.port), ReadinessHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        timings = asyncio.run(warm_up(args.url))
+        with lock:
+            status.update(ready=True, timings=timings)
+        logger.info('ready')
+    except Exception as e:
+        # the probe keeps failing, so the container never takes traffic
+        with lock:
+            status['error'] = str(e)
+        logger.error('warm-up failed: %s', e)
+    thread.join()